@@ -1,3 +0,0 @@
-import gi
-gi.require_version('Modulemd', '2.0')
-from gi.repository import Modulemd  # noqa: F401, E402
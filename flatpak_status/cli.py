@@ -1,27 +1,74 @@
-from datetime import timedelta
-import json
+from datetime import datetime, timedelta
 import logging
 import os
+import resource
 import signal
 import time
+import tracemalloc
 
 import click
-from flatpak_indexer import fedora_monitor
-from flatpak_indexer.bodhi_query import refresh_update_status, reset_update_cache
 from flatpak_indexer.http_utils import HttpConfig
 from flatpak_indexer.koji_utils import KojiConfig
-from flatpak_indexer.redis_utils import RedisConfig
+from flatpak_indexer.redis_utils import get_redis_client, RedisConfig
 
 from . import distgit
-from .update import Investigation, Session, UpdateJsonEncoder
+from .history import HistoryStore
+from .nvr import set_sort_key_cache_size, sort_key_cache_info
+from .package_index import query_affected_flatpaks, query_package_flatpak_builds
+from .resilience import CircuitOpenError
+from .results import encode_json, get_summary_caches, set_summary_cache_sizes
+from .server import StatusServer
+from .snapshot import get_snapshot_path, load_snapshot, save_snapshot, SnapshotError
+
+# Modules that are slow to import - the investigation code, and the Bodhi
+# and fedmsg modules of flatpak_indexer - are imported by the commands that
+# use them, so that --help, render, serve and query start quickly.
+# tests/test_startup.py checks this.
 
 logger = logging.getLogger(__name__)
 
+# How often 'serve' checks for a new snapshot, in seconds
+SNAPSHOT_POLL_INTERVAL = 10
+
 
 class Config(HttpConfig, KojiConfig, RedisConfig):
     cache_dir: str
     output: str
     update_interval: timedelta = timedelta(seconds=1800)
+    # Maximum number of concurrent local git queries and git fetches
+    git_jobs: int = 8
+    fetch_jobs: int = 4
+    # Maximum number of entries in the caches kept for the life of the process
+    build_summary_cache_size: int = 50000
+    update_summary_cache_size: int = 20000
+    nvr_sort_key_cache_size: int = 100000
+    missing_commits_cache_size: int = 1000
+    # Maximum number of concurrent refreshes of Koji and Bodhi information,
+    # and how long to wait for each one
+    refresh_jobs: int = 4
+    refresh_timeout: timedelta = timedelta(minutes=10)
+    # When more Bodhi updates than this change between daemon updates, all
+    # updates are refreshed instead of each changed one
+    max_update_refreshes: int = 200
+    # Timeouts for git commands that are local and that talk to dist-git,
+    # and how many times to try the latter
+    git_timeout: timedelta = timedelta(minutes=2)
+    git_fetch_timeout: timedelta = timedelta(minutes=10)
+    git_fetch_attempts: int = 3
+    # After this many failures for a git repository, it's skipped for the
+    # rest of the update, and the affected Flatpaks are reported as stale;
+    # after this many consecutive failed fetches, dist-git itself is skipped
+    failure_threshold: int = 3
+    # If set, the daemon serves Server-Sent Events about changes and the query
+    # API on this port; also the default port for 'serve'
+    http_port: int = 0
+    http_address: str = 'localhost'
+    # If set, each update is recorded in this SQLite database, and kept for
+    # history_retention, for 'flatpak-status query'
+    history_db: str = ''
+    history_retention: timedelta = timedelta(days=90)
+    # On restart, the daemon reuses the last update if it is more recent than this
+    warm_start_max_age: timedelta = timedelta(hours=6)
 
 
 @click.group()
@@ -50,47 +97,307 @@ class GlobalObjects:
         self.config = config
         self.distgit = distgit.DistGit(base_url='https://src.fedoraproject.org',
                                        mirror_dir=os.path.join(config.cache_dir, 'distgit'),
-                                       mirror_existing=mirror_existing)
+                                       mirror_existing=mirror_existing,
+                                       missing_commits_size=config.missing_commits_cache_size,
+                                       timeout=config.git_timeout.total_seconds(),
+                                       fetch_timeout=config.git_fetch_timeout.total_seconds(),
+                                       fetch_attempts=config.git_fetch_attempts)
+        # Shared by all sessions, so that Redis connections are pooled for
+        # the life of the process
+        self.redis_client = get_redis_client(config)
+        set_summary_cache_sizes(config.build_summary_cache_size,
+                                config.update_summary_cache_size)
+        set_sort_key_cache_size(config.nvr_sort_key_cache_size)
+        self.last_result = None
+        # Set when the daemon is serving HTTP
+        self.server = None
 
     def make_session(self):
-        return Session(self.config, self.distgit)
+        from .update import Session
+
+        return Session(self.config, self.distgit, redis_client=self.redis_client)
+
+
+def log_resource_usage(global_objects):
+    # ru_maxrss is in kilobytes on Linux
+    max_rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    logger.info("Peak RSS: %.1f MiB", max_rss / 1024)
+
+    # The caches that outlive an update
+    build_summaries, update_summaries = get_summary_caches()
+    sort_keys = sort_key_cache_info()
+    missing_commits = global_objects.distgit.missing_commits
+    logger.info("Cache sizes: build summaries=%d (%d evicted), "
+                "update summaries=%d (%d evicted), NVR sort keys=%d (%d evicted), "
+                "repositories with missing commits=%d (%d evicted)",
+                len(build_summaries), build_summaries.evictions,
+                len(update_summaries), update_summaries.evictions,
+                sort_keys.currsize, sort_keys.misses - sort_keys.currsize,
+                len(missing_commits), missing_commits.evictions)
+    if global_objects.last_result is not None:
+        logger.info("Last result kept: %d Flatpaks",
+                    len(global_objects.last_result.flatpaks))
+
+    if tracemalloc.is_tracing():
+        current, peak = tracemalloc.get_traced_memory()
+        logger.info("Traced memory: current=%.1f MiB, peak=%.1f MiB",
+                    current / (1024 * 1024), peak / (1024 * 1024))
+        tracemalloc.reset_peak()
+
+
+def write_output(output, result):
+    # Write atomically, so that the web server never sees a partial file
+    tmp_output = output + '.tmp'
+    with open(tmp_output, 'wb') as f:
+        f.write(encode_json(result.to_json()))
+    os.replace(tmp_output, output)
+
+
+def publish(global_objects, result):
+    write_output(global_objects.config.output, result)
+    if global_objects.server is not None:
+        global_objects.server.publish(result)
 
 
-def do_update(global_objects):
-    session = global_objects.make_session()
+def do_update(global_objects, jobs=1, changed_flatpaks=frozenset(), session=None):
+    from .update import Investigation
+
+    config = global_objects.config
+    if session is None:
+        session = global_objects.make_session()
+
+    # Publish the Flatpaks affected by security updates as soon as they are investigated
+    def on_partial_result(partial_result):
+        previous = global_objects.last_result
+        publish(global_objects, partial_result.fill_stale(previous).merge_into(previous))
+        logger.info("Published partial results at %s", config.output)
 
     investigation = Investigation()
-    investigation.investigate(session)
+    investigation.investigate(
+        session, jobs=jobs,
+        on_partial_result=on_partial_result if global_objects.last_result else None,
+        changed_flatpaks=changed_flatpaks
+    )
+    result = investigation.result()
+    if global_objects.last_result:
+        result = result.fill_stale(global_objects.last_result)
+
+    save_snapshot(get_snapshot_path(config), result)
+    publish(global_objects, result)
+    global_objects.last_result = result
 
-    with open(global_objects.config.output, 'w') as f:
-        json.dump(investigation, f, cls=UpdateJsonEncoder, indent=4)
+    logger.info("Successfully created json cache at %s", config.output)
 
-    logger.info("Successfully created json cache at %s", global_objects.config.output)
+    if config.history_db:
+        with HistoryStore(config.history_db) as store:
+            store.record(result, retention=config.history_retention)
+        logger.info("Recorded update in %s", config.history_db)
+
+    log_resource_usage(global_objects)
 
 
 @click.option('--mirror-existing/--no-mirror-existing', is_flag=True, default=True,
               help="Updating mirrors of distgit repos that already existing locally")
+@click.option('--jobs', '-j', type=click.IntRange(min=1), default=1,
+              help="Number of worker processes to investigate Flatpaks with")
 @cli.command(name="update")
 @click.pass_context
-def update(ctx, mirror_existing):
+def update(ctx, mirror_existing, jobs):
     """Regenerate status.json"""
 
     global_objects = GlobalObjects(ctx.obj['config'],
                                    mirror_existing=mirror_existing)
-    do_update(global_objects)
+    do_update(global_objects, jobs=jobs)
+
+
+@click.option('--output', '-o',
+              help="Output filename (defaults to the configured output)")
+@cli.command(name="render")
+@click.pass_context
+def render(ctx, output):
+    """Regenerate status.json from the last update, without refreshing"""
+
+    config = ctx.obj['config']
+    try:
+        result = load_snapshot(get_snapshot_path(config))
+    except SnapshotError as e:
+        raise click.ClickException(str(e)) from e
+
+    if output is None:
+        output = config.output
+    write_output(output, result)
+
+    logger.info("Successfully rendered %s", output)
+
+
+@click.argument('package')
+@cli.command(name="which-flatpaks")
+@click.pass_context
+def which_flatpaks(ctx, package):
+    """List the Flatpak builds that contain a package, as of the last update"""
+
+    redis_client = GlobalObjects(ctx.obj['config']).redis_client
+    for nvr in query_package_flatpak_builds(redis_client, package):
+        click.echo(nvr)
+
+
+@click.option('--port', '-p', type=int,
+              help="Port to serve on (defaults to http_port from the config file)")
+@cli.command(name="serve")
+@click.pass_context
+def serve(ctx, port):
+    """Serve the query API for the last update, without updating"""
+
+    config = ctx.obj['config']
+    if port is None:
+        port = config.http_port
+    if not port:
+        raise click.ClickException("No port given, and http_port is not configured")
+
+    server = StatusServer(config.http_address, port)
+    server.start()
+
+    # Pick up the snapshots written by updates run separately
+    snapshot_path = get_snapshot_path(config)
+    snapshot_mtime = None
+    while True:
+        try:
+            mtime = os.stat(snapshot_path).st_mtime
+        except FileNotFoundError:
+            mtime = None
+
+        if mtime is not None and mtime != snapshot_mtime:
+            snapshot_mtime = mtime
+            try:
+                result = load_snapshot(snapshot_path)
+            except SnapshotError as e:
+                logger.warning("%s", e)
+            else:
+                logger.info("Serving the update at %s", result.date_updated)
+                server.publish(result)
 
+        time.sleep(SNAPSHOT_POLL_INTERVAL)
 
+
+@cli.group(name="query")
+@click.pass_context
+def query(ctx):
+    """Answer questions from the history database"""
+
+    config = ctx.obj['config']
+    if not config.history_db:
+        raise click.ClickException("history_db is not configured")
+    if not os.path.exists(config.history_db):
+        raise click.ClickException(f"{config.history_db} does not exist")
+
+
+def _format_time(dt):
+    return dt.strftime('%Y-%m-%d %H:%M')
+
+
+def _echo_state(state):
+    if state.stale:
+        status = 'stale'
+    elif state.good:
+        status = 'up-to-date'
+    else:
+        status = 'out-of-date'
+    if state.has_security_updates:
+        status += ', missing security updates'
+
+    click.echo(f"{state.flatpak}: {status}, "
+               f"{_format_time(state.since)} - {_format_time(state.until)}")
+
+
+@click.argument('flatpak')
+@query.command(name="flatpak")
+@click.pass_context
+def query_flatpak(ctx, flatpak):
+    """Show how the status of a Flatpak changed over time"""
+
+    with HistoryStore(ctx.obj['config'].history_db) as store:
+        for state in store.query_flatpak(flatpak):
+            _echo_state(state)
+
+
+@query.command(name="out-of-date")
+@click.pass_context
+def query_out_of_date(ctx):
+    """Show the Flatpaks that are out-of-date, and since when"""
+
+    with HistoryStore(ctx.obj['config'].history_db) as store:
+        for state in store.query_out_of_date():
+            click.echo(f"{state.flatpak}: out-of-date since {_format_time(state.since)}")
+
+
+@click.option('--since', type=click.DateTime(), required=True,
+              help="Start of the time range (UTC)")
+@click.option('--until', type=click.DateTime(),
+              help="End of the time range (UTC, defaults to now)")
+@query.command(name="security")
+@click.pass_context
+def query_security(ctx, since, until):
+    """Show the Flatpaks that were missing security updates in a time range"""
+
+    if until is None:
+        until = datetime.utcnow()
+    with HistoryStore(ctx.obj['config'].history_db) as store:
+        for state in store.query_security(since, until):
+            _echo_state(state)
+
+
+def load_warm_start(config):
+    try:
+        result = load_snapshot(get_snapshot_path(config))
+    except SnapshotError as e:
+        logger.info("Not warm-starting: %s", e)
+        return None
+
+    age = datetime.utcnow() - result.date_updated
+    if age > config.warm_start_max_age:
+        logger.info("Not warm-starting: last update at %s is too old", result.date_updated)
+        return None
+
+    return result
+
+
+@click.option('--trace-memory', is_flag=True,
+              help="Trace Python memory allocations, and report them after each update")
 @cli.command(name="daemon")
 @click.pass_context
-def daemon(ctx):
+def daemon(ctx, trace_memory):
+    from flatpak_indexer import fedora_monitor
+    from flatpak_indexer.bodhi_query import reset_update_cache
+    from flatpak_indexer.release_info import ReleaseStatus
+
+    from .update import refresh_update_statuses
+
     # With KeyboardInterrupt handling, the main thread won't exit until
     # the thread dies, but the thread won't die unless some subprocess
     # caught the SIGINT and caused a traceback... It's better to just exit.
     signal.signal(signal.SIGINT, signal.SIG_DFL)
 
+    if trace_memory:
+        tracemalloc.start()
+
     config = ctx.obj['config']
     global_objects = GlobalObjects(config, mirror_existing=False)
 
+    if config.http_port:
+        global_objects.server = StatusServer(config.http_address, config.http_port)
+        global_objects.server.start()
+
+    # If the last update is recent, publish it right away, and rely on the
+    # Redis cache and the git mirrors being mostly up-to-date: rather than a
+    # full resync, the first update only catches up with what the last one
+    # looked at. (The monitor's serials only have meaning within a single
+    # process, so can't be used to tell what changed meanwhile.)
+    warm_start = load_warm_start(config)
+    if warm_start is not None:
+        logger.info("Warm-starting from the update at %s", warm_start.date_updated)
+        publish(global_objects, warm_start)
+        global_objects.last_result = warm_start
+
     monitor = fedora_monitor.FedoraMonitor(
         config, watch_bodhi_updates=True, watch_distgit_changes=True
     )
@@ -108,29 +415,68 @@ def daemon(ctx):
 
         bodhi_changed, serial = monitor.get_bodhi_changed()
 
+        if bodhi_changed is None and warm_start is not None:
+            # Updates that were pending or in testing might have been pushed since
+            bodhi_changed = warm_start.list_unsettled_updates()
+            logger.info("Catching up with %d Bodhi updates since the warm-start update",
+                        len(bodhi_changed))
+
+        # Repositories and backends that fail while catching up are skipped
+        # for the rest of the update, as with failures during the update
         session = global_objects.make_session()
+        if bodhi_changed is not None and len(bodhi_changed) > config.max_update_refreshes:
+            logger.info("%d Bodhi updates changed, refreshing all updates", len(bodhi_changed))
+            bodhi_changed = None
+
         if bodhi_changed is None:
-            reset_update_cache(session)
-        else:
-            for bodhi_update_id in bodhi_changed:
-                refresh_update_status(session, bodhi_update_id)
+            try:
+                reset_update_cache(session)
+            except Exception:
+                logger.exception("Failed to reset the Bodhi cache")
+        elif bodhi_changed:
+            refresh_update_statuses(session, bodhi_changed)
 
         monitor.clear_bodhi_changed(serial)
 
         distgit_changed, serial = monitor.get_distgit_changed()
 
+        changed_flatpaks = set()
+        catching_up = distgit_changed is None and warm_start is not None
+        if catching_up:
+            # Only the mirrors of the packages that the warm-start update looked at
+            distgit_changed = {'rpms/' + package for package in warm_start.list_packages()}
+            logger.info("Catching up with %d git mirrors since the warm-start update",
+                        len(distgit_changed))
+
         if distgit_changed is None:
-            global_objects.distgit.mirror_all()
+            global_objects.distgit.mirror_all(session.breaker)
         else:
-            for path in distgit_changed:
+            # The monitor only tells us which repositories changed, not which
+            # branch, so fetch the branches that investigations look at
+            branches = {r.branch: None
+                        for r in session.fedora_releases if r.status != ReleaseStatus.EOL}
+            for path in sorted(distgit_changed):
                 repo = global_objects.distgit.repo(path)
                 if repo.exists():
                     logger.info("Updating git mirror %s", path)
-                    repo.mirror(mirror_always=True)
+                    try:
+                        with distgit.track_distgit_health(session.breaker):
+                            repo.mirror_branches(branches)
+                    except (distgit.GitError, CircuitOpenError) as e:
+                        logger.warning("Failed to update git mirror: %s", e)
+                        session.breaker.trip(path)
+
+            # When catching up, all the Flatpaks might have changed, so none go first
+            if not catching_up:
+                changed_packages = {path[len('rpms/'):]
+                                    for path in distgit_changed if path.startswith('rpms/')}
+                changed_flatpaks = query_affected_flatpaks(global_objects.redis_client,
+                                                           changed_packages)
 
         monitor.clear_distgit_changed(serial)
+        warm_start = None
 
         try:
-            do_update(global_objects)
+            do_update(global_objects, changed_flatpaks=changed_flatpaks, session=session)
         except Exception:
             logger.exception("Failed to update JSON cache")
@@ -1,81 +1,263 @@
-import functools
+import asyncio
+from contextlib import contextmanager
 import logging
 import os
+import shutil
 import subprocess
+import time
+
+from .lru import LRUCache
+from .resilience import CircuitOpenError, retry_async
 
 logger = logging.getLogger(__name__)
 
+# The name dist-git itself has in circuit breakers
+DISTGIT_BACKEND = 'dist-git'
+
 
 class GitError(Exception):
     pass
 
 
+class MissingCommitError(GitError):
+    pass
+
+
 class OrderingError(Exception):
     pass
 
 
 class GitRepo:
-    def __init__(self, repo_dir):
+    def __init__(self, repo_dir, timeout=None):
         self.repo_dir = repo_dir
+        # In seconds, for commands that don't talk to a remote
+        self.timeout = timeout
+
+    def _log_timing(self, args, start):
+        logger.debug("%s: git %s took %.3fs", self.repo_dir, args[0], time.perf_counter() - start)
 
     def do(self, *args):
         full_args = ['git']
         full_args += args
+        start = time.perf_counter()
         try:
-            subprocess.check_call(full_args, cwd=self.repo_dir)
-        except subprocess.CalledProcessError as e:
+            subprocess.check_call(full_args, cwd=self.repo_dir, timeout=self.timeout)
+        except (subprocess.CalledProcessError, subprocess.TimeoutExpired) as e:
             raise GitError(f"{self.repo_dir}: {e}") from e
+        finally:
+            self._log_timing(args, start)
 
     def capture(self, *args):
         full_args = ['git']
         full_args += args
+        start = time.perf_counter()
         try:
-            return subprocess.check_output(full_args, cwd=self.repo_dir, encoding='UTF-8').strip()
-        except subprocess.CalledProcessError as e:
+            return subprocess.check_output(full_args, cwd=self.repo_dir, encoding='UTF-8',
+                                           timeout=self.timeout).strip()
+        except (subprocess.CalledProcessError, subprocess.TimeoutExpired) as e:
             raise GitError(f"{self.repo_dir}: {e}") from e
+        finally:
+            self._log_timing(args, start)
+
+    async def _run_async(self, args, cwd, capture, timeout):
+        full_args = ['git']
+        full_args += args
+        start = time.perf_counter()
+        try:
+            proc = await asyncio.create_subprocess_exec(
+                *full_args, cwd=cwd, stdout=subprocess.PIPE if capture else None
+            )
+            try:
+                stdout, _ = await asyncio.wait_for(proc.communicate(), timeout)
+            except asyncio.TimeoutError:
+                try:
+                    proc.kill()
+                except ProcessLookupError:
+                    pass
+                await proc.wait()
+                e = subprocess.TimeoutExpired(full_args, timeout)
+                raise GitError(f"{self.repo_dir}: {e}") from None
+        finally:
+            self._log_timing(args, start)
+
+        if proc.returncode != 0:
+            e = subprocess.CalledProcessError(proc.returncode, full_args)
+            raise GitError(f"{self.repo_dir}: {e}")
+
+        if capture:
+            return stdout.decode('UTF-8').strip()
+
+    async def do_async(self, *args):
+        await self._run_async(args, cwd=self.repo_dir, capture=False, timeout=self.timeout)
+
+    async def capture_async(self, *args):
+        return await self._run_async(args, cwd=self.repo_dir, capture=True, timeout=self.timeout)
 
 
 class DistGitRepo(GitRepo):
-    def __init__(self, pkg, repo_dir, origin, mirror_existing=True):
-        super().__init__(repo_dir)
+    def __init__(self, pkg, repo_dir, origin, mirror_existing=True, missing_commits=None,
+                 timeout=None, fetch_timeout=None, fetch_attempts=1, fetch_retry_delay=5):
+        super().__init__(repo_dir, timeout=timeout)
         self.pkg = pkg
         self.origin = origin
         self.mirror_existing = mirror_existing
+        # Commits that weren't found, even after trying to fetch them
+        self.missing_commits = missing_commits if missing_commits is not None else set()
+        self.fetch_timeout = fetch_timeout
+        self.fetch_attempts = fetch_attempts
+        self.fetch_retry_delay = fetch_retry_delay
 
     def exists(self):
         return os.path.exists(self.repo_dir)
 
+    def mirror_fetches(self, mirror_always=False):
+        """Whether mirror() talks to origin, rather than leaving an existing mirror as is"""
+        return not self.exists() or self.mirror_existing or mirror_always
+
+    async def _fetch_once_async(self, *args):
+        await self._run_async(args, cwd=self.repo_dir, capture=False, timeout=self.fetch_timeout)
+
+    async def _fetch_async(self, *args):
+        # Runs a command that talks to origin, retrying on failure
+        await retry_async(lambda: self._fetch_once_async(*args),
+                          attempts=self.fetch_attempts, delay=self.fetch_retry_delay,
+                          exceptions=(GitError,))
+
+    async def _clone_async(self, parent_dir):
+        try:
+            await self._run_async(['clone', '--mirror', self.origin], cwd=parent_dir,
+                                  capture=False, timeout=self.fetch_timeout)
+        except GitError:
+            # A clone that timed out leaves a partial repository behind
+            shutil.rmtree(self.repo_dir, ignore_errors=True)
+            raise
+
     def mirror(self, mirror_always=False):
+        asyncio.run(self.mirror_async(mirror_always=mirror_always))
+
+    async def mirror_async(self, mirror_always=False):
+        if not self.mirror_fetches(mirror_always=mirror_always):
+            return
+
         if not self.exists():
             parent_dir = os.path.dirname(self.repo_dir)
             if not os.path.isdir(parent_dir):
                 os.makedirs(parent_dir)
-            subprocess.check_call(['git', 'clone', '--mirror', self.origin],
-                                  cwd=parent_dir)
+            await retry_async(lambda: self._clone_async(parent_dir),
+                              attempts=self.fetch_attempts, delay=self.fetch_retry_delay,
+                              exceptions=(GitError,))
         else:
-            if self.mirror_existing or mirror_always:
-                logger.info("Refreshing existing mirror %s", self.pkg)
-                self.do('remote', 'update')
+            logger.info("Refreshing existing mirror %s", self.pkg)
+            await self._fetch_async('remote', 'update')
+
+        self.missing_commits.clear()
+        await self.write_commit_graph_async()
+
+    async def _branch_head_async(self, branch):
+        try:
+            return await self.capture_async('rev-parse', '--quiet', '--verify',
+                                            'refs/heads/' + branch)
+        except GitError:
+            return None
+
+    def mirror_branches(self, branches):
+        asyncio.run(self.mirror_branches_async(branches))
+
+    async def mirror_branches_async(self, branches):
+        """Refresh only some branches of an existing mirror
+
+        branches maps branch names to the commit the branch is known to have
+        moved to, or to None if that isn't known. Branches that already point
+        to the announced commit, and branches that don't exist in the mirror,
+        are skipped.
+        """
+        refspecs = []
+        for branch, commit in sorted(branches.items()):
+            head = await self._branch_head_async(branch)
+            if head is None or head == commit:
+                continue
+            refspecs.append(f'+refs/heads/{branch}:refs/heads/{branch}')
+
+        if len(refspecs) == 0:
+            return
+
+        logger.info("Refreshing branches of existing mirror %s", self.pkg)
+        try:
+            await self._fetch_once_async('fetch', 'origin', *refspecs)
+        except GitError:
+            # e.g., a branch was deleted upstream - fall back to updating everything
+            logger.warning("Failed to fetch branches of %s, refreshing all", self.pkg)
+            await self._fetch_async('remote', 'update')
+
+        self.missing_commits.clear()
+        await self.write_commit_graph_async()
+
+    async def write_commit_graph_async(self):
+        # Generation numbers from the commit-graph make the ancestry walks
+        # behind 'branch --contains' and 'merge-base' much cheaper. --split
+        # only writes commits new since the last write, as a new layer.
+        try:
+            await self.do_async('commit-graph', 'write', '--reachable', '--split', '--no-progress')
+        except GitError as e:
+            # Purely an optimization - queries still work without it
+            logger.warning("Failed to write commit-graph: %s", e)
+
+    async def _get_branches_async(self, commit):
+        output = await self.capture_async('branch',
+                                          '--contains', commit,
+                                          '--format=%(refname:lstrip=2)')
+        return output.split('\n')
+
+    async def _has_commit_async(self, commit):
+        try:
+            await self.do_async('cat-file', '-e', commit + '^{commit}')
+            return True
+        except GitError:
+            return False
+
+    async def _fetch_commit_async(self, commit):
+        """Fetches commit from origin, returning False if origin doesn't have it
 
-    def _get_branches(self, commit, try_mirroring=False):
-        return self.capture('branch',
-                            '--contains', commit,
-                            '--format=%(refname:lstrip=2)').split('\n')
+        If origin can't be reached, GitError is raised instead - that says
+        nothing about whether the commit exists.
+        """
+        # Updating the branches finds the ones that contain the commit, and
+        # shows that origin is reachable
+        await self._fetch_async('fetch', '--quiet', 'origin', '+refs/heads/*:refs/heads/*')
+
+        if not await self._has_commit_async(commit):
+            # A commit that isn't on any branch can still be fetched by ID;
+            # origin was just reached, so failure means that it doesn't have it
+            try:
+                await self._fetch_once_async('fetch', '--quiet', 'origin', commit)
+            except GitError:
+                return False
+
+        await self.write_commit_graph_async()
+
+        return True
 
     def get_branches(self, commit, try_mirroring=False):
-        need_retry = False
+        return asyncio.run(self.get_branches_async(commit, try_mirroring=try_mirroring))
+
+    async def get_branches_async(self, commit, try_mirroring=False):
+        if commit in self.missing_commits:
+            raise MissingCommitError(f"{self.repo_dir}: {commit} is missing from the repository")
+
         try:
-            return self._get_branches(commit)
+            return await self._get_branches_async(commit)
         except GitError:
-            if try_mirroring:
-                logger.warning(f"Couldn't find {commit} in {self.repo_dir}, refreshing mirror")
-                need_retry = True
-            else:
+            if not try_mirroring:
                 raise
 
-        if need_retry:
-            self.mirror(mirror_always=True)
-            return self._get_branches(commit)
+        logger.warning(f"Couldn't find {commit} in {self.repo_dir}, fetching it")
+        if not await self._fetch_commit_async(commit):
+            self.missing_commits.add(commit)
+            raise MissingCommitError(
+                f"{self.repo_dir}: {commit} is missing from the repository and origin"
+            )
+
+        return await self._get_branches_async(commit)
 
     def rev_parse(self, ref):
         return self.capture('rev-parse', ref)
@@ -84,15 +266,27 @@ class DistGitRepo(GitRepo):
         try:
             self.capture('rev-parse', '--quiet', '--verify', rev)
             return True
-        except subprocess.CalledProcessError:
+        except GitError:
             return False
 
     def order(self, commits):
-        def compare(a, b):
+        return asyncio.run(self.order_async(commits))
+
+    async def order_async(self, commits):
+        # sorted() can't await comparisons, so this is a merge sort - it
+        # needs O(n log n) comparisons, each running a git merge-base, one
+        # at a time. Each pair of commits is only compared once.
+        merge_bases = {}
+
+        async def compare(a, b):
             if a == b:
                 return 0
 
-            base = self.capture('merge-base', a, b)
+            key = (a, b) if a < b else (b, a)
+            base = merge_bases.get(key)
+            if base is None:
+                base = merge_bases[key] = await self.capture_async('merge-base', a, b)
+
             if base == a:
                 return -1
             elif base == b:
@@ -100,23 +294,89 @@ class DistGitRepo(GitRepo):
             else:
                 raise OrderingError(f"Commits {a} and {b} are not comparable")
 
-        return sorted(commits, key=functools.cmp_to_key(compare))
+        async def merge_sort(items):
+            if len(items) <= 1:
+                return items
+
+            middle = len(items) // 2
+            left = await merge_sort(items[:middle])
+            right = await merge_sort(items[middle:])
+
+            result = []
+            i = j = 0
+            while i < len(left) and j < len(right):
+                # Take from the left on ties, so the sort is stable
+                if await compare(right[j], left[i]) < 0:
+                    result.append(right[j])
+                    j += 1
+                else:
+                    result.append(left[i])
+                    i += 1
+
+            return result + left[i:] + right[j:]
+
+        return await merge_sort(list(commits))
+
+
+@contextmanager
+def track_distgit_health(breaker):
+    """Keeps track in breaker of whether dist-git answers the fetches made in the block
+
+    After enough consecutive failures, dist-git is marked unhealthy, and
+    CircuitOpenError is raised without trying, rather than each repository
+    using up its timeouts and retries in turn.
+    """
+    breaker.check(DISTGIT_BACKEND)
+    try:
+        yield
+    except MissingCommitError:
+        # dist-git answered, just not with the commit
+        breaker.record_success(DISTGIT_BACKEND)
+        raise
+    except GitError:
+        breaker.record_failure(DISTGIT_BACKEND)
+        raise
+
+    breaker.record_success(DISTGIT_BACKEND)
 
 
 class DistGit:
-    def __init__(self, base_url, mirror_dir, mirror_existing=True):
+    def __init__(self, base_url, mirror_dir, mirror_existing=True, missing_commits_size=1000,
+                 timeout=None, fetch_timeout=None, fetch_attempts=1, fetch_retry_delay=5):
         self.base_url = base_url
         self.mirror_dir = mirror_dir
         self.mirror_existing = mirror_existing
+        # Kept for the lifetime of the process, so bounded by number of repositories
+        self.missing_commits = LRUCache(missing_commits_size)
+        # Timeouts and delays are in seconds
+        self.timeout = timeout
+        self.fetch_timeout = fetch_timeout
+        self.fetch_attempts = fetch_attempts
+        self.fetch_retry_delay = fetch_retry_delay
 
     def repo(self, pkg):
         return DistGitRepo(pkg,
                            repo_dir=os.path.join(self.mirror_dir, pkg + '.git'),
                            origin=self.base_url + '/' + pkg,
-                           mirror_existing=self.mirror_existing)
+                           mirror_existing=self.mirror_existing,
+                           missing_commits=self.missing_commits.setdefault(pkg, set()),
+                           timeout=self.timeout,
+                           fetch_timeout=self.fetch_timeout,
+                           fetch_attempts=self.fetch_attempts,
+                           fetch_retry_delay=self.fetch_retry_delay)
 
-    def mirror_all(self):
+    def mirror_all(self, breaker):
+        """Refreshes all the mirrors, marking those that fail unhealthy in breaker"""
         for f in sorted(os.listdir(self.mirror_dir)):
             for g in sorted(os.listdir(os.path.join(self.mirror_dir, f))):
                 if g.endswith('.git'):
-                    self.repo(os.path.join(f, g[:-4])).mirror(mirror_always=True)
+                    pkg = os.path.join(f, g[:-4])
+                    try:
+                        with track_distgit_health(breaker):
+                            self.repo(pkg).mirror(mirror_always=True)
+                    except CircuitOpenError as e:
+                        logger.warning("Not refreshing the remaining mirrors: %s", e)
+                        return
+                    except GitError as e:
+                        logger.warning("Failed to refresh mirror: %s", e)
+                        breaker.trip(pkg)
@@ -0,0 +1,295 @@
+from datetime import datetime
+import sqlite3
+
+from .results import InvestigationResult
+
+# The history of investigation results is kept in SQLite. Each update is a
+# generation; rather than storing everything for every generation, each
+# state table has a row per interval of generations over which the state
+# of something - a Flatpak, a Flatpak build, a package in a Flatpak build -
+# didn't change. An update extends the intervals that are still current,
+# and starts new ones for what changed.
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS generations (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    date_updated TEXT NOT NULL
+);
+CREATE INDEX IF NOT EXISTS generations_date_updated ON generations(date_updated);
+
+CREATE TABLE IF NOT EXISTS flatpak_states (
+    id INTEGER PRIMARY KEY,
+    flatpak TEXT NOT NULL,
+    -- NULL if the Flatpak wasn't checked
+    good INTEGER,
+    has_security_updates INTEGER NOT NULL,
+    stale INTEGER NOT NULL,
+    first_generation INTEGER NOT NULL,
+    last_generation INTEGER NOT NULL
+);
+CREATE INDEX IF NOT EXISTS flatpak_states_flatpak
+    ON flatpak_states(flatpak, last_generation);
+CREATE INDEX IF NOT EXISTS flatpak_states_last_generation
+    ON flatpak_states(last_generation);
+CREATE INDEX IF NOT EXISTS flatpak_states_security
+    ON flatpak_states(has_security_updates, last_generation);
+
+CREATE TABLE IF NOT EXISTS build_states (
+    id INTEGER PRIMARY KEY,
+    flatpak TEXT NOT NULL,
+    nvr TEXT NOT NULL,
+    update_id TEXT,
+    update_status TEXT,
+    good INTEGER NOT NULL,
+    has_security_updates INTEGER NOT NULL,
+    first_generation INTEGER NOT NULL,
+    last_generation INTEGER NOT NULL
+);
+CREATE INDEX IF NOT EXISTS build_states_flatpak ON build_states(flatpak, last_generation);
+CREATE INDEX IF NOT EXISTS build_states_last_generation ON build_states(last_generation);
+
+CREATE TABLE IF NOT EXISTS package_states (
+    id INTEGER PRIMARY KEY,
+    flatpak_nvr TEXT NOT NULL,
+    package TEXT NOT NULL,
+    nvr TEXT NOT NULL,
+    branch TEXT,
+    -- NULL for builds without a source in Koji
+    commit_id TEXT,
+    good INTEGER NOT NULL,
+    first_generation INTEGER NOT NULL,
+    last_generation INTEGER NOT NULL
+);
+CREATE INDEX IF NOT EXISTS package_states_package ON package_states(package, last_generation);
+CREATE INDEX IF NOT EXISTS package_states_last_generation ON package_states(last_generation);
+
+CREATE TABLE IF NOT EXISTS history_items (
+    package_state INTEGER NOT NULL REFERENCES package_states(id) ON DELETE CASCADE,
+    position INTEGER NOT NULL,
+    commit_id TEXT,
+    nvr TEXT NOT NULL,
+    update_id TEXT,
+    update_status TEXT,
+    update_type TEXT,
+    PRIMARY KEY (package_state, position)
+);
+"""
+
+
+def _time_to_db(dt):
+    return dt.strftime('%Y-%m-%dT%H:%M:%SZ')
+
+
+def _time_from_db(s):
+    return datetime.strptime(s, '%Y-%m-%dT%H:%M:%SZ')
+
+
+class FlatpakState:
+    def __init__(self, flatpak, good, has_security_updates, stale, since, until):
+        self.flatpak = flatpak
+        # None if the Flatpak wasn't checked
+        self.good = None if good is None else bool(good)
+        self.has_security_updates = bool(has_security_updates)
+        self.stale = bool(stale)
+        # Update times of the first and last generations with this state
+        self.since = _time_from_db(since)
+        self.until = _time_from_db(until)
+
+
+class HistoryStore:
+    def __init__(self, path):
+        self.connection = sqlite3.connect(path)
+        self.connection.execute('PRAGMA foreign_keys = ON')
+        self.connection.executescript(SCHEMA)
+
+    def close(self):
+        self.connection.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+    def _last_generation(self):
+        row = self.connection.execute('SELECT MAX(id) FROM generations').fetchone()
+        return row[0]
+
+    def _update_intervals(self, table, key_columns, state_columns, states, generation):
+        """Extends or starts intervals in table
+
+        states maps tuples of key column values to tuples of state column
+        values. Returns a dictionary of key => row ID for the new intervals.
+        """
+        previous = self._last_generation_before(generation)
+        current = {}
+        if previous is not None:
+            columns = ', '.join(('id',) + key_columns + state_columns)
+            cursor = self.connection.execute(
+                f'SELECT {columns} FROM {table} WHERE last_generation = ?', (previous,)
+            )
+            for row in cursor:
+                key = tuple(row[1:1 + len(key_columns)])
+                current[key] = (row[0], tuple(row[1 + len(key_columns):]))
+
+        extended = []
+        new = {}
+        insert = (f'INSERT INTO {table} '
+                  f'({", ".join(key_columns + state_columns)}, first_generation, last_generation) '
+                  f'VALUES ({", ".join("?" * (len(key_columns) + len(state_columns) + 2))})')
+        for key, state in states.items():
+            row_id, current_state = current.get(key, (None, None))
+            if current_state == state:
+                extended.append((generation, row_id))
+            else:
+                cursor = self.connection.execute(insert, key + state + (generation, generation))
+                new[key] = cursor.lastrowid
+
+        self.connection.executemany(f'UPDATE {table} SET last_generation = ? WHERE id = ?',
+                                    extended)
+
+        return new
+
+    def _last_generation_before(self, generation):
+        row = self.connection.execute('SELECT MAX(id) FROM generations WHERE id < ?',
+                                      (generation,)).fetchone()
+        return row[0]
+
+    def record(self, result: InvestigationResult, retention=None):
+        """Adds a generation for result, and drops generations older than retention"""
+        with self.connection:
+            cursor = self.connection.execute('INSERT INTO generations (date_updated) VALUES (?)',
+                                             (_time_to_db(result.date_updated),))
+            generation = cursor.lastrowid
+
+            flatpak_states = {}
+            build_states = {}
+            package_states = {}
+            packages = {}
+            for flatpak in result.flatpaks:
+                good = flatpak.is_good()
+                flatpak_states[(flatpak.name,)] = (
+                    None if good is None else int(good),
+                    int(flatpak.has_security_updates()), int(flatpak.stale)
+                )
+                for build in flatpak.builds:
+                    update = build.update
+                    build_states[(flatpak.name, build.build.nvr)] = (
+                        update.id if update else None,
+                        update.status if update else None,
+                        int(build.is_good()),
+                        int(build.has_security_updates()),
+                    )
+                    for package in build.packages:
+                        key = (build.build.nvr, package.name)
+                        package_states[key] = (
+                            package.build.nvr, package.branch, package.commit,
+                            int(package.is_good()),
+                        )
+                        packages[key] = package
+
+            self._update_intervals('flatpak_states', ('flatpak',),
+                                   ('good', 'has_security_updates', 'stale'),
+                                   flatpak_states, generation)
+            self._update_intervals('build_states', ('flatpak', 'nvr'),
+                                   ('update_id', 'update_status', 'good', 'has_security_updates'),
+                                   build_states, generation)
+            new_package_states = self._update_intervals(
+                'package_states', ('flatpak_nvr', 'package'),
+                ('nvr', 'branch', 'commit_id', 'good'),
+                package_states, generation
+            )
+
+            # The history of a package can change without its state changing - when
+            # an update is pushed to stable, for example - but it's kept for the
+            # interval, since that's what is needed to explain the state.
+            self.connection.executemany(
+                'INSERT INTO history_items VALUES (?, ?, ?, ?, ?, ?, ?)',
+                ((row_id, position, item.commit, item.build.nvr,
+                  item.update.id if item.update else None,
+                  item.update.status if item.update else None,
+                  item.update.type if item.update else None)
+                 for key, row_id in new_package_states.items()
+                 for position, item in enumerate(packages[key].history))
+            )
+
+            if retention is not None:
+                self._expire(result.date_updated - retention)
+
+    def _expire(self, before):
+        row = self.connection.execute('SELECT MIN(id) FROM generations WHERE date_updated >= ?',
+                                      (_time_to_db(before),)).fetchone()
+        oldest = row[0]
+        if oldest is None:
+            return
+
+        for table in ('flatpak_states', 'build_states', 'package_states'):
+            self.connection.execute(f'DELETE FROM {table} WHERE last_generation < ?', (oldest,))
+            self.connection.execute(
+                f'UPDATE {table} SET first_generation = ? WHERE first_generation < ?',
+                (oldest, oldest)
+            )
+        self.connection.execute('DELETE FROM generations WHERE id < ?', (oldest,))
+
+    def _flatpak_states(self, where, params):
+        cursor = self.connection.execute(
+            'SELECT s.flatpak, s.good, s.has_security_updates, s.stale, '
+            '       first.date_updated, last.date_updated '
+            'FROM flatpak_states s '
+            'JOIN generations first ON first.id = s.first_generation '
+            'JOIN generations last ON last.id = s.last_generation '
+            f'WHERE {where} '
+            'ORDER BY s.flatpak, s.first_generation',
+            params
+        )
+        return [FlatpakState(*row) for row in cursor]
+
+    def query_flatpak(self, flatpak):
+        """Returns the states of a Flatpak over time"""
+        return self._flatpak_states('s.flatpak = ?', (flatpak,))
+
+    def _out_of_date_since(self, flatpak):
+        # A new state starts whenever anything about the Flatpak changes - it
+        # picks up a security update, say - so walk back over the run of
+        # out-of-date states that ends with the current one. Generation IDs
+        # are consecutive, so a gap means that the Flatpak wasn't there.
+        cursor = self.connection.execute(
+            'SELECT s.good, s.first_generation, s.last_generation, first.date_updated '
+            'FROM flatpak_states s '
+            'JOIN generations first ON first.id = s.first_generation '
+            'WHERE s.flatpak = ? '
+            'ORDER BY s.first_generation DESC',
+            (flatpak,)
+        )
+        since = None
+        next_first_generation = None
+        for good, first_generation, last_generation, date_updated in cursor:
+            if good != 0:
+                break
+            if next_first_generation is not None and last_generation != next_first_generation - 1:
+                break
+            since = date_updated
+            next_first_generation = first_generation
+
+        return _time_from_db(since)
+
+    def query_out_of_date(self):
+        """Returns the current states of the Flatpaks that are currently out-of-date
+
+        The since of each state is when the Flatpak became out-of-date, even
+        if its state changed in other ways after that.
+        """
+        states = self._flatpak_states('s.last_generation = ? AND s.good = 0',
+                                      (self._last_generation(),))
+        for state in states:
+            state.since = self._out_of_date_since(state.flatpak)
+
+        return states
+
+    def query_security(self, since, until):
+        """Returns the states with unfixed security updates between since and until"""
+        return self._flatpak_states(
+            's.has_security_updates = 1 AND '
+            'first.date_updated <= ? AND last.date_updated >= ?',
+            (_time_to_db(until), _time_to_db(since))
+        )
@@ -0,0 +1,47 @@
+from collections import OrderedDict
+
+
+class LRUCache:
+    """A mapping that holds at most max_size entries, evicting the least recently used"""
+
+    def __init__(self, max_size):
+        self.max_size = max_size
+        self.evictions = 0
+        self._entries = OrderedDict()
+
+    def __len__(self):
+        return len(self._entries)
+
+    def __contains__(self, key):
+        return key in self._entries
+
+    def get(self, key, default=None):
+        try:
+            value = self._entries[key]
+        except KeyError:
+            return default
+
+        self._entries.move_to_end(key)
+        return value
+
+    def __setitem__(self, key, value):
+        self._entries[key] = value
+        self._entries.move_to_end(key)
+        self._evict()
+
+    def _evict(self):
+        while len(self._entries) > self.max_size:
+            self._entries.popitem(last=False)
+            self.evictions += 1
+
+    def resize(self, max_size):
+        self.max_size = max_size
+        self._evict()
+
+    def setdefault(self, key, default):
+        value = self.get(key, self)
+        if value is self:
+            self[key] = default
+            value = default
+
+        return value
@@ -0,0 +1,82 @@
+import logging
+
+import yaml
+
+logger = logging.getLogger(__name__)
+
+# The only thing needed from the modulemd of a module build is the ref
+# that each rpm component was built from. Parsing the whole document with
+# libmodulemd through GObject introspection is slow, so when the C YAML
+# loader is available, the refs are picked out of the plain YAML instead.
+# Anything unexpected falls back to libmodulemd, which knows all the rules.
+try:
+    _Loader = yaml.CSafeLoader
+except AttributeError:
+    _Loader = None
+
+
+def _get_rpm_refs_fast(modulemd, name, stream):
+    if _Loader is None:
+        return None
+
+    try:
+        documents = list(yaml.load_all(modulemd, Loader=_Loader))
+    except yaml.YAMLError:
+        return None
+
+    # A built module has exactly one modulemd v2 document, for its stream
+    if len(documents) != 1:
+        return None
+
+    document = documents[0]
+    if not (isinstance(document, dict) and
+            document.get('document') == 'modulemd' and document.get('version') == 2):
+        return None
+
+    data = document.get('data')
+    if not (isinstance(data, dict) and data.get('name') == name and data.get('stream') == stream):
+        return None
+
+    components = data.get('components') or {}
+    if not isinstance(components, dict):
+        return None
+
+    rpms = components.get('rpms') or {}
+    if not isinstance(rpms, dict):
+        return None
+
+    refs = {}
+    for component_name, component in rpms.items():
+        if not (isinstance(component_name, str) and isinstance(component, dict)):
+            return None
+        ref = component.get('ref')
+        if not isinstance(ref, str):
+            return None
+        refs[component_name] = ref
+
+    return refs
+
+
+def _get_rpm_refs_libmodulemd(modulemd, name, stream):
+    import gi
+    gi.require_version('Modulemd', '2.0')
+    from gi.repository import Modulemd
+
+    module_index = Modulemd.ModuleIndex.new()
+    module_index.update_from_string(modulemd, strict=False)
+    module_stream = module_index.get_module(name).get_streams_by_stream_name(stream)[0]
+
+    return {
+        component_name: module_stream.get_rpm_component(component_name).get_ref()
+        for component_name in module_stream.get_rpm_component_names()
+    }
+
+
+def get_rpm_refs(modulemd, name, stream):
+    """Returns a dictionary of rpm component name => ref from the modulemd of a module build"""
+    refs = _get_rpm_refs_fast(modulemd, name, stream)
+    if refs is None:
+        logger.debug("Parsing modulemd for %s:%s with libmodulemd", name, stream)
+        refs = _get_rpm_refs_libmodulemd(modulemd, name, stream)
+
+    return refs
@@ -0,0 +1,64 @@
+import functools
+import re
+
+# Ordering of version tokens, as in rpmvercmp(): a tilde sorts before
+# everything, even the end of the version, a caret sorts after the end but
+# before anything else, and numeric segments sort after alphabetic ones.
+_TILDE = 0
+_END = 1
+_CARET = 2
+_ALPHA = 3
+_NUMERIC = 4
+
+# Everything else is a separator
+_TOKEN_RE = re.compile(r'~|\^|[0-9]+|[A-Za-z]+')
+
+
+# Releases like '1.fc29' are shared between many NVRs
+@functools.lru_cache(maxsize=10000)
+def _version_key(version):
+    key = []
+    for token in _TOKEN_RE.findall(version):
+        if token == '~':
+            key.append((_TILDE,))
+        elif token == '^':
+            key.append((_CARET,))
+        elif token[0].isdigit():
+            key.append((_NUMERIC, int(token)))
+        else:
+            key.append((_ALPHA, token))
+    key.append((_END,))
+
+    return tuple(key)
+
+
+def _make_sort_key(nvr):
+    name, version, release = str(nvr).rsplit('-', 2)
+    epoch, _, version = version.rpartition(':')
+
+    return (name, int(epoch) if epoch else 0, _version_key(version), _version_key(release))
+
+
+# Kept for the life of the process; replaced to change its size
+_sort_keys = functools.lru_cache(maxsize=100000)(_make_sort_key)
+
+
+def nvr_sort_key(nvr):
+    """Returns a key that sorts NVRs the way rpm does
+
+    The name is compared as a string, then the epoch (if the version has
+    one, as in 'name-1:2.0-1') and the version and release with the rules
+    of rpmvercmp(). Keys are memoized, since the same NVRs are sorted over
+    and over again.
+    """
+    return _sort_keys(nvr)
+
+
+def set_sort_key_cache_size(max_size):
+    """Sets how many NVR sort keys are memoized, discarding the memoized keys"""
+    global _sort_keys
+    _sort_keys = functools.lru_cache(maxsize=max_size)(_make_sort_key)
+
+
+def sort_key_cache_info():
+    return _sort_keys.cache_info()
@@ -0,0 +1,56 @@
+import json
+
+from .nvr import nvr_sort_key
+
+# Redis hash of source package name => JSON list of the NVRs of the Flatpak
+# builds that contain it. It's rewritten from scratch whenever the Flatpak
+# builds are refreshed, by building a new hash and renaming it into place.
+KEY = 'status:package-flatpaks'
+
+
+def update_package_index(redis_client, build_packages):
+    """Replaces the index
+
+    build_packages maps Flatpak build NVRs to the names of the source packages
+    they contain.
+    """
+    index = {}
+    for nvr, packages in build_packages.items():
+        for package in packages:
+            index.setdefault(package, set()).add(str(nvr))
+
+    tmp_key = KEY + ':new'
+    with redis_client.pipeline() as pipe:
+        pipe.delete(tmp_key)
+        if index:
+            pipe.hset(tmp_key, mapping={
+                package: json.dumps(sorted(nvrs, key=nvr_sort_key))
+                for package, nvrs in index.items()
+            })
+            pipe.rename(tmp_key, KEY)
+        else:
+            pipe.delete(KEY)
+        pipe.execute()
+
+
+def query_package_flatpak_builds(redis_client, package):
+    """Returns the NVRs of the Flatpak builds that contain a source package"""
+    value = redis_client.hget(KEY, package)
+    if value is None:
+        return []
+
+    return json.loads(value)
+
+
+def query_affected_flatpaks(redis_client, packages):
+    """Returns the names of the Flatpaks with builds that contain any of packages"""
+    packages = sorted(packages)
+    if len(packages) == 0:
+        return set()
+
+    result = set()
+    for value in redis_client.hmget(KEY, packages):
+        if value is not None:
+            result.update(nvr.rsplit('-', 2)[0] for nvr in json.loads(value))
+
+    return result
@@ -0,0 +1,58 @@
+import asyncio
+import logging
+
+logger = logging.getLogger(__name__)
+
+
+class CircuitOpenError(Exception):
+    pass
+
+
+class CircuitBreaker:
+    """Tracks failures of operations on git repositories and backends
+
+    After threshold consecutive failures for a name, or when tripped
+    directly, the name is marked unhealthy, and check() raises
+    CircuitOpenError for it, so nothing more is tried with it. A circuit
+    breaker lasts for a single update, so everything gets tried again the
+    next time.
+    """
+
+    def __init__(self, threshold, unhealthy=()):
+        self.threshold = threshold
+        self.failures = {}
+        self.unhealthy = set(unhealthy)
+
+    def is_healthy(self, name):
+        return name not in self.unhealthy
+
+    def check(self, name):
+        if name in self.unhealthy:
+            raise CircuitOpenError(f"{name} is marked unhealthy")
+
+    def record_success(self, name):
+        self.failures.pop(name, None)
+
+    def record_failure(self, name):
+        self.failures[name] = self.failures.get(name, 0) + 1
+        if self.failures[name] >= self.threshold:
+            self.trip(name)
+
+    def trip(self, name):
+        if name not in self.unhealthy:
+            logger.warning("Marking %s unhealthy for the rest of the update", name)
+            self.unhealthy.add(name)
+
+
+async def retry_async(func, attempts, delay, exceptions=(Exception,)):
+    """Calls and awaits func() up to attempts times, doubling delay after each failure"""
+    for attempt in range(1, attempts + 1):
+        try:
+            return await func()
+        except exceptions as e:
+            if attempt == attempts:
+                raise
+
+            logger.warning("%s, retrying in %.1fs", e, delay)
+            await asyncio.sleep(delay)
+            delay *= 2
@@ -0,0 +1,352 @@
+import json
+import sys
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+from .lru import LRUCache
+
+
+# The classes here hold the results of an investigation in a compact form:
+# only what is needed to generate the output is kept, in slotted objects,
+# with NVRs and commit IDs interned, and no references back to the build
+# and update models or to libmodulemd objects.
+#
+# to_json() converts a whole tree to plain dicts and lists in one pass, so
+# it can be handed directly to encode_json().
+#
+# Verdicts - whether packages are up-to-date, and whether there are
+# security updates the Flatpak doesn't have - are computed here and
+# included in the output, so the web page doesn't have to compute them by
+# walking all the package histories. web/verdicts.js has the same logic,
+# as a fallback for older output; tests/verdicts.json checks that they agree.
+#
+# The same build or update shows up many times in the output - a library
+# is in many Flatpaks - so their summaries are shared for the lifetime of
+# the process, and each summary caches its JSON fragments. Builds are
+# immutable, so are keyed by ID; updates are also keyed by their status and
+# type, which change over time.
+_build_summaries = LRUCache(50000)
+_update_summaries = LRUCache(20000)
+
+
+def set_summary_cache_sizes(build_summaries, update_summaries):
+    """Sets how many build and update summaries are kept around for sharing"""
+    _build_summaries.resize(build_summaries)
+    _update_summaries.resize(update_summaries)
+
+
+def get_summary_caches():
+    """Returns the caches of build and update summaries, for reporting"""
+    return _build_summaries, _update_summaries
+
+
+def _intern(s):
+    if s is None:
+        return None
+    # str() strips subclasses like NVR, which can't be interned
+    return sys.intern(str(s))
+
+
+def _time_to_json(dt):
+    return dt.strftime('%Y-%m-%dT%H:%M:%SZ')
+
+
+class BuildSummary:
+    __slots__ = ('id', 'nvr', 'user_name', 'completion_time', '_json', '_details_json')
+
+    def __init__(self, id, nvr, user_name, completion_time):
+        self.id = id
+        self.nvr = nvr
+        self.user_name = user_name
+        self.completion_time = completion_time
+        self._json = None
+        self._details_json = None
+
+    def __reduce__(self):
+        # Don't pickle the cached JSON
+        return (BuildSummary, (self.id, self.nvr, self.user_name, self.completion_time))
+
+    @classmethod
+    def from_model(cls, build):
+        summary = _build_summaries.get(build.build_id)
+        if summary is None:
+            summary = cls(build.build_id, _intern(build.nvr),
+                          _intern(build.user_name), build.completion_time)
+            _build_summaries[build.build_id] = summary
+
+        return summary
+
+    def to_json(self, include_details=False):
+        # The returned dictionary is shared, and must not be modified
+        if include_details:
+            if self._details_json is None:
+                self._details_json = {
+                    'id': self.id,
+                    'nvr': self.nvr,
+                    'user_name': self.user_name,
+                    'completion_time': _time_to_json(self.completion_time),
+                }
+            return self._details_json
+        else:
+            if self._json is None:
+                self._json = {
+                    'id': self.id,
+                    'nvr': self.nvr,
+                }
+            return self._json
+
+
+class UpdateSummary:
+    __slots__ = ('id', 'status', 'type', 'user_name', 'date_submitted', '_json', '_details_json')
+
+    def __init__(self, id, status, type, user_name, date_submitted):
+        self.id = id
+        self.status = status
+        self.type = type
+        self.user_name = user_name
+        self.date_submitted = date_submitted
+        self._json = None
+        self._details_json = None
+
+    def __reduce__(self):
+        # Don't pickle the cached JSON
+        return (UpdateSummary,
+                (self.id, self.status, self.type, self.user_name, self.date_submitted))
+
+    @classmethod
+    def from_model(cls, update):
+        if update is None:
+            return None
+
+        key = (update.update_id, update.status, update.type)
+        summary = _update_summaries.get(key)
+        if summary is None:
+            summary = cls(_intern(update.update_id), _intern(update.status),
+                          _intern(update.type), _intern(update.user_name),
+                          update.date_submitted)
+            _update_summaries[key] = summary
+
+        return summary
+
+    def to_json(self, include_details=False):
+        # The returned dictionary is shared, and must not be modified
+        if include_details:
+            if self._details_json is None:
+                self._details_json = {
+                    'id': self.id,
+                    'status': self.status,
+                    'type': self.type,
+                    'user_name': self.user_name,
+                    'date_submitted': _time_to_json(self.date_submitted),
+                }
+            return self._details_json
+        else:
+            if self._json is None:
+                self._json = {
+                    'id': self.id,
+                    'status': self.status,
+                    'type': self.type,
+                }
+            return self._json
+
+
+class HistoryItem:
+    __slots__ = ('commit', 'build', 'update', 'is_release_version')
+
+    def __init__(self, commit, build: BuildSummary, update: UpdateSummary | None,
+                 is_release_version):
+        self.commit = _intern(commit)
+        self.build = build
+        self.update = update
+        self.is_release_version = is_release_version
+
+    def to_json(self):
+        result = {
+            'commit': self.commit,
+            'build': self.build.to_json(),
+        }
+        if self.update is not None:
+            result['update'] = self.update.to_json()
+
+        return result
+
+
+class PackageResult:
+    __slots__ = ('build', 'module_build', 'branch', 'commit', 'history')
+
+    def __init__(self, build: BuildSummary, module_build: BuildSummary | None,
+                 branch, commit, history):
+        self.build = build
+        self.module_build = module_build
+        self.branch = _intern(branch)
+        self.commit = _intern(commit)
+        self.history = tuple(history)
+
+    @property
+    def name(self):
+        return self.build.nvr.rsplit('-', 2)[0]
+
+    def is_good(self):
+        # Up-to-date, or only missing an update that's still in testing
+        history = self.history
+        return (self.commit == history[0].commit or
+                (len(history) > 1 and
+                 history[0].update is not None and history[0].update.status == 'testing' and
+                 self.commit == history[1].commit))
+
+    def has_security_updates(self):
+        # Whether newer builds than the one in the Flatpak fix security issues
+        for item in self.history:
+            if item.commit == self.commit:
+                break
+
+            if (item.update is not None and
+                    item.update.type == 'security' and item.update.status != 'testing'):
+                return True
+
+        return False
+
+    def to_json(self):
+        result = {
+            'build': self.build.to_json(),
+            'branch': self.branch,
+            'commit': self.commit,
+            'history': [item.to_json() for item in self.history],
+            'good': self.is_good(),
+        }
+        if self.module_build:
+            result['module_build'] = self.module_build.to_json()
+        return result
+
+
+class FlatpakBuildResult:
+    __slots__ = ('build', 'update', 'packages')
+
+    def __init__(self, build: BuildSummary, update: UpdateSummary | None, packages):
+        self.build = build
+        self.update = update
+        self.packages = tuple(packages)
+
+    def out_of_date_packages(self):
+        return [package.name for package in self.packages if not package.is_good()]
+
+    def is_good(self):
+        return all(package.is_good() for package in self.packages)
+
+    def has_security_updates(self):
+        return any(package.has_security_updates() for package in self.packages)
+
+    def to_json(self):
+        result = {
+            'build': self.build.to_json(include_details=True),
+            'packages': [package.to_json() for package in self.packages],
+            'good': self.is_good(),
+            'has_security_updates': self.has_security_updates(),
+            'out_of_date_packages': self.out_of_date_packages(),
+        }
+
+        if self.update is not None:
+            result['update'] = self.update.to_json(include_details=True)
+
+        return result
+
+
+class FlatpakResult:
+    __slots__ = ('name', 'builds', 'stale')
+
+    def __init__(self, name, builds, stale=False):
+        self.name = name
+        self.builds = tuple(builds)
+        # Set if the Flatpak couldn't be investigated, and builds are from a previous update
+        self.stale = stale
+
+    def is_good(self):
+        # A stale Flatpak without builds from a previous update wasn't checked
+        # at all, so it's neither good nor bad
+        if self.stale and not self.builds:
+            return None
+
+        return all(build.is_good() for build in self.builds)
+
+    def has_security_updates(self):
+        return any(build.has_security_updates() for build in self.builds)
+
+    def to_json(self):
+        result = {
+            'name': self.name,
+            'builds': [build.to_json() for build in self.builds],
+            'good': self.is_good(),
+            'has_security_updates': self.has_security_updates(),
+        }
+        if self.stale:
+            result['stale'] = True
+
+        return result
+
+
+class InvestigationResult:
+    __slots__ = ('date_updated', 'flatpaks')
+
+    def __init__(self, date_updated, flatpaks):
+        self.date_updated = date_updated
+        self.flatpaks = tuple(flatpaks)
+
+    def merge_into(self, previous: 'InvestigationResult'):
+        """Returns previous, with the Flatpaks in this result replacing the old ones
+
+        The update date of previous is kept, since most Flatpaks weren't updated.
+        """
+        flatpaks = {f.name: f for f in previous.flatpaks}
+        flatpaks.update((f.name, f) for f in self.flatpaks)
+
+        return InvestigationResult(previous.date_updated,
+                                   [flatpaks[name] for name in sorted(flatpaks)])
+
+    def fill_stale(self, previous: 'InvestigationResult'):
+        """Returns this result, with the builds of stale Flatpaks taken from previous"""
+        previous_flatpaks = {f.name: f for f in previous.flatpaks}
+
+        flatpaks = []
+        for flatpak in self.flatpaks:
+            if flatpak.stale and flatpak.name in previous_flatpaks:
+                flatpak = FlatpakResult(flatpak.name, previous_flatpaks[flatpak.name].builds,
+                                        stale=True)
+            flatpaks.append(flatpak)
+
+        return InvestigationResult(self.date_updated, flatpaks)
+
+    def list_packages(self):
+        """Returns the names of the packages in the Flatpak builds"""
+        return {package.name
+                for flatpak in self.flatpaks
+                for build in flatpak.builds
+                for package in build.packages}
+
+    def list_unsettled_updates(self):
+        """Returns the IDs of the updates that might still change status"""
+        updates = set()
+        for flatpak in self.flatpaks:
+            for build in flatpak.builds:
+                updates.add(build.update)
+                for package in build.packages:
+                    updates.update(item.update for item in package.history)
+
+        return {update.id for update in updates
+                if update is not None and update.status in ('pending', 'testing')}
+
+    def to_json(self):
+        return {
+            'date_updated': _time_to_json(self.date_updated),
+            'flatpaks': [flatpak.to_json() for flatpak in self.flatpaks],
+        }
+
+
+def encode_json(data):
+    """Encodes plain data as indented JSON, using orjson if it is installed"""
+    if orjson is not None:
+        return orjson.dumps(data, option=orjson.OPT_INDENT_2)
+    else:
+        return json.dumps(data, indent=4).encode('UTF-8')
@@ -0,0 +1,325 @@
+from collections import defaultdict
+import hashlib
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+import json
+import logging
+import queue
+import threading
+from urllib.parse import parse_qs, unquote, urlparse
+
+from .results import InvestigationResult
+
+logger = logging.getLogger(__name__)
+
+# Comments are sent this often to idle event streams, so that proxies don't
+# time them out, and so disconnected clients are noticed
+KEEPALIVE_INTERVAL = 15
+
+
+def _format_event(event, data):
+    return f'event: {event}\ndata: {json.dumps(data, separators=(",", ":"))}\n\n'.encode('UTF-8')
+
+
+class Subscription:
+    def __init__(self, max_queued):
+        # Each item is the list of events for one publication
+        self.queue = queue.Queue(max_queued)
+        # Set if the client fell too far behind, and should reconnect
+        self.closed = False
+
+
+class EventBroadcaster:
+    """Sends Server-Sent Events about changes between published results
+
+    For each Flatpak that is new or has changed, a 'flatpak' event with its
+    JSON is sent, for each Flatpak that is gone, a 'removed' event, and then
+    an 'updated' event with the new update date. A client that falls too far
+    behind is disconnected; the browser reconnects, and reloads everything.
+    """
+
+    def __init__(self, max_queued=10):
+        self.max_queued = max_queued
+        self.lock = threading.Lock()
+        self.subscriptions = set()
+        # Flatpak name => event last sent for it
+        self.flatpak_events = {}
+
+    def subscribe(self):
+        subscription = Subscription(self.max_queued)
+        with self.lock:
+            self.subscriptions.add(subscription)
+
+        return subscription
+
+    def unsubscribe(self, subscription):
+        with self.lock:
+            self.subscriptions.discard(subscription)
+
+    def publish(self, result: InvestigationResult):
+        flatpak_events = {
+            flatpak.name: _format_event('flatpak', flatpak.to_json())
+            for flatpak in result.flatpaks
+        }
+
+        events = [event for name, event in flatpak_events.items()
+                  if self.flatpak_events.get(name) != event]
+        events += [_format_event('removed', {'name': name})
+                   for name in sorted(self.flatpak_events.keys() - flatpak_events.keys())]
+        events.append(_format_event('updated', {
+            'date_updated': result.date_updated.strftime('%Y-%m-%dT%H:%M:%SZ'),
+        }))
+
+        with self.lock:
+            self.flatpak_events = flatpak_events
+            for subscription in list(self.subscriptions):
+                try:
+                    subscription.queue.put_nowait(events)
+                except queue.Full:
+                    logger.info("Disconnecting an event stream that fell behind")
+                    subscription.closed = True
+                    self.subscriptions.discard(subscription)
+
+
+# Values of the status filter of /api/flatpaks
+STATUSES = ('good', 'out-of-date', 'security', 'stale')
+
+
+class ResultIndex:
+    """Indexes of a published result, for the query API
+
+    The indexes are built once for each publication, so that a request only
+    touches the part of the result it returns. Paths, relative to /api, are:
+
+      /flatpaks - summaries of all Flatpaks, filtered by the status, package,
+          and update query parameters
+      /flatpaks/<name> - the full JSON for a Flatpak
+      /packages/<name> - the builds of a package in Flatpaks
+      /updates/<id> - summaries of the Flatpaks with a build in an update,
+          or with a package that has a build in it
+      /status - counts of Flatpaks by status
+    """
+
+    def __init__(self, result: InvestigationResult):
+        self.date_updated = result.date_updated.strftime('%Y-%m-%dT%H:%M:%SZ')
+        self.flatpaks = {}
+        self.summaries = {}
+        self.statuses = {status: set() for status in STATUSES}
+        # package name => list of (Flatpak name, FlatpakBuildResult, PackageResult)
+        self.packages = defaultdict(list)
+        # update ID => set of Flatpak names
+        self.updates = defaultdict(set)
+
+        for flatpak in result.flatpaks:
+            name = flatpak.name
+            good = flatpak.is_good()
+            has_security_updates = flatpak.has_security_updates()
+
+            self.flatpaks[name] = flatpak
+            self.summaries[name] = {
+                'name': name,
+                'good': good,
+                'has_security_updates': has_security_updates,
+                'stale': flatpak.stale,
+            }
+
+            # good is None for a Flatpak that wasn't checked
+            if good is not None:
+                self.statuses['good' if good else 'out-of-date'].add(name)
+            if has_security_updates:
+                self.statuses['security'].add(name)
+            if flatpak.stale:
+                self.statuses['stale'].add(name)
+
+            for build in flatpak.builds:
+                if build.update is not None:
+                    self.updates[build.update.id].add(name)
+                for package in build.packages:
+                    self.packages[package.name].append((name, build, package))
+                    for item in package.history:
+                        if item.update is not None:
+                            self.updates[item.update.id].add(name)
+
+    def query(self, path, params):
+        """Returns the JSON for path, or None if there is nothing there
+
+        Raises ValueError for bad parameters.
+        """
+        parts = [unquote(part) for part in path.strip('/').split('/')]
+
+        if parts == ['status']:
+            return {
+                'date_updated': self.date_updated,
+                'flatpaks': len(self.flatpaks),
+                'statuses': {status: len(names) for status, names in self.statuses.items()},
+            }
+        elif parts == ['flatpaks']:
+            return {
+                'date_updated': self.date_updated,
+                'flatpaks': [self.summaries[name] for name in self._filter_flatpaks(params)],
+            }
+        elif len(parts) == 2 and parts[0] == 'flatpaks':
+            flatpak = self.flatpaks.get(parts[1])
+            if flatpak is None:
+                return None
+            return {
+                'date_updated': self.date_updated,
+                'flatpak': flatpak.to_json(),
+            }
+        elif len(parts) == 2 and parts[0] == 'packages':
+            builds = self.packages.get(parts[1])
+            if builds is None:
+                return None
+            return {
+                'date_updated': self.date_updated,
+                'package': parts[1],
+                'builds': [{
+                    'flatpak': flatpak_name,
+                    'build': build.build.to_json(),
+                    'package': package.to_json(),
+                } for flatpak_name, build, package in builds],
+            }
+        elif len(parts) == 2 and parts[0] == 'updates':
+            names = self.updates.get(parts[1])
+            if names is None:
+                return None
+            return {
+                'date_updated': self.date_updated,
+                'update': parts[1],
+                'flatpaks': [self.summaries[name] for name in sorted(names)],
+            }
+        else:
+            return None
+
+    def _filter_flatpaks(self, params):
+        names = None
+
+        def restrict(matching):
+            nonlocal names
+            names = set(matching) if names is None else names & matching
+
+        status = params.get('status')
+        if status is not None:
+            if status not in self.statuses:
+                raise ValueError(f"Unknown status '{status}', "
+                                 f"expected one of {', '.join(STATUSES)}")
+            restrict(self.statuses[status])
+
+        package = params.get('package')
+        if package is not None:
+            restrict({flatpak_name for flatpak_name, _, _ in self.packages.get(package, ())})
+
+        update = params.get('update')
+        if update is not None:
+            restrict(self.updates.get(update, set()))
+
+        return sorted(self.flatpaks if names is None else names)
+
+
+class _RequestHandler(BaseHTTPRequestHandler):
+    def log_message(self, format, *args):
+        logger.debug("%s: " + format, self.address_string(), *args)
+
+    def do_GET(self):
+        url = urlparse(self.path)
+        if url.path == '/events':
+            self._send_events()
+        elif url.path == '/api' or url.path.startswith('/api/'):
+            self._send_query(url.path[len('/api'):], url.query)
+        else:
+            self.send_error(404)
+
+    def _send_query(self, path, query):
+        index = self.server.status_server.index
+        if index is None:
+            self.send_error(503, "No investigation has been published yet")
+            return
+
+        params = {key: values[-1] for key, values in parse_qs(query).items()}
+        try:
+            data = index.query(path, params)
+        except ValueError as e:
+            self.send_error(400, str(e))
+            return
+
+        if data is None:
+            self.send_error(404)
+            return
+
+        body = json.dumps(data, separators=(',', ':')).encode('UTF-8')
+        etag = '"' + hashlib.blake2b(body, digest_size=16).hexdigest() + '"'
+
+        if_none_match = self.headers.get('If-None-Match')
+        if if_none_match is not None:
+            tags = [tag.strip() for tag in if_none_match.split(',')]
+            if etag in tags or '*' in tags:
+                self.send_response(304)
+                self.send_header('ETag', etag)
+                self.end_headers()
+                return
+
+        self.send_response(200)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        self.send_header('ETag', etag)
+        self.send_header('Cache-Control', 'no-cache')
+        self.send_header('Access-Control-Allow-Origin', '*')
+        self.end_headers()
+        self.wfile.write(body)
+
+    def _send_events(self):
+        broadcaster = self.server.status_server.broadcaster
+        subscription = broadcaster.subscribe()
+        try:
+            self.send_response(200)
+            self.send_header('Content-Type', 'text/event-stream')
+            self.send_header('Cache-Control', 'no-cache')
+            self.send_header('Access-Control-Allow-Origin', '*')
+            self.end_headers()
+            self.wfile.flush()
+
+            while not subscription.closed:
+                try:
+                    events = subscription.queue.get(timeout=KEEPALIVE_INTERVAL)
+                except queue.Empty:
+                    events = [b': keepalive\n\n']
+
+                if subscription.closed:
+                    break
+
+                for event in events:
+                    self.wfile.write(event)
+                self.wfile.flush()
+        except (BrokenPipeError, ConnectionResetError):
+            pass
+        finally:
+            broadcaster.unsubscribe(subscription)
+
+
+class StatusServer:
+    """HTTP server for change events and queries, run in the background"""
+
+    def __init__(self, address, port):
+        self.broadcaster = EventBroadcaster()
+        # Replaced as a whole on each publication, so requests see a consistent index
+        self.index = None
+        self.httpd = ThreadingHTTPServer((address, port), _RequestHandler)
+        self.httpd.daemon_threads = True
+        self.httpd.status_server = self
+
+    @property
+    def port(self):
+        return self.httpd.server_address[1]
+
+    def start(self):
+        thread = threading.Thread(target=self.httpd.serve_forever,
+                                  name='status-server', daemon=True)
+        thread.start()
+        logger.info("Serving on port %d", self.port)
+
+    def stop(self):
+        self.httpd.shutdown()
+        self.httpd.server_close()
+
+    def publish(self, result: InvestigationResult):
+        self.index = ResultIndex(result)
+        self.broadcaster.publish(result)
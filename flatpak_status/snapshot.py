@@ -0,0 +1,39 @@
+import os
+import pickle
+
+from .results import InvestigationResult
+
+# Increase when the classes in results.py change incompatibly
+SNAPSHOT_VERSION = 2
+
+
+class SnapshotError(Exception):
+    pass
+
+
+def get_snapshot_path(config):
+    return os.path.join(config.cache_dir, 'investigation.pickle')
+
+
+def save_snapshot(path, result: InvestigationResult):
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+
+    tmp_path = path + '.tmp'
+    with open(tmp_path, 'wb') as f:
+        pickle.dump((SNAPSHOT_VERSION, result), f, protocol=pickle.HIGHEST_PROTOCOL)
+    os.replace(tmp_path, path)
+
+
+def load_snapshot(path) -> InvestigationResult:
+    try:
+        with open(path, 'rb') as f:
+            version, result = pickle.load(f)
+    except FileNotFoundError:
+        raise SnapshotError(f"{path}: No snapshot of an investigation") from None
+    except (pickle.UnpicklingError, EOFError, AttributeError, ValueError) as e:
+        raise SnapshotError(f"{path}: Can't load snapshot: {e}") from e
+
+    if version != SNAPSHOT_VERSION:
+        raise SnapshotError(f"{path}: Snapshot version {version}, expected {SNAPSHOT_VERSION}")
+
+    return result
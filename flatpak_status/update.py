@@ -1,12 +1,19 @@
 #!/usr/bin/python3
 
+import asyncio
+from collections import defaultdict
+from concurrent.futures import ProcessPoolExecutor
 from datetime import datetime
 import json
 import logging
-from typing import List
+import multiprocessing
+import threading
+from typing import Dict, List
 from urllib.parse import urlparse
 
-from flatpak_indexer.bodhi_query import list_updates, refresh_all_updates, refresh_updates
+from flatpak_indexer.bodhi_query import (
+    list_updates, refresh_all_updates, refresh_update_status, refresh_updates
+)
 from flatpak_indexer.koji_query import (
     list_flatpak_builds, query_tag_builds,
     refresh_flatpak_builds, refresh_tag_builds
@@ -17,66 +24,180 @@ from flatpak_indexer.models import (
 from flatpak_indexer.release_info import ReleaseStatus
 import flatpak_indexer.session
 
-from . import Modulemd
-from .distgit import OrderingError
+from .distgit import GitError, OrderingError, track_distgit_health
+from .modulemd import get_rpm_refs
+from .nvr import nvr_sort_key
+from .package_index import update_package_index
+from .resilience import CircuitBreaker, CircuitOpenError
+from .results import (
+    BuildSummary, FlatpakBuildResult, FlatpakResult, HistoryItem,
+    InvestigationResult, PackageResult, UpdateSummary
+)
 
 logger = logging.getLogger(__name__)
 
 
-class Session(flatpak_indexer.session.Session):
-    def __init__(self, config, distgit):
-        super().__init__(config)
-        self.distgit = distgit
-        self.package_investigation_cache = {}
-
-
-def _time_to_json(dt):
-    return dt.strftime('%Y-%m-%dT%H:%M:%SZ')
-
+def _make_indexer_session(config, redis_client=None):
+    session = flatpak_indexer.session.Session(config)
+    if redis_client is not None:
+        # Redis clients are thread-safe, and share a connection pool
+        session.redis_client = redis_client
 
-def _build_to_json(build, include_details=False):
-    result = {
-        'id': build.build_id,
-        'nvr': build.nvr,
-    }
+    return session
 
-    if include_details:
-        result['user_name'] = build.user_name
-        result['completion_time'] = _time_to_json(build.completion_time)
 
-    return result
+class Session(flatpak_indexer.session.Session):
+    def __init__(self, config, distgit, redis_client=None):
+        super().__init__(config)
+        if redis_client is not None:
+            # Shared between sessions, so that connections are reused across updates
+            self.redis_client = redis_client
+        self.distgit = distgit
+        # Module build NVR => rpm refs from its modulemd, shared between Flatpak builds.
+        # A session lasts for a single update, so this doesn't need to be bounded.
+        self.module_stream_cache = {}
+        # Git repositories and backends that failed during this update
+        self.breaker = CircuitBreaker(config.failure_threshold)
+
+
+class Scheduler:
+    """Bounds and shares the concurrent work of a single investigation
+
+    Koji, Bodhi and Redis are accessed through synchronous clients, so those
+    calls are made directly from the event loop, apart from the refreshes
+    done by Refresher; the git commands are what run concurrently.
+    """
+
+    def __init__(self, git_jobs, fetch_jobs, breaker: CircuitBreaker, fetch=True):
+        self.breaker = breaker
+        # If False, commits missing from the mirrors aren't fetched
+        self.fetch = fetch
+        # Local git queries
+        self.git_semaphore = asyncio.Semaphore(git_jobs)
+        # Network fetches into the mirrors
+        self.fetch_semaphore = asyncio.Semaphore(fetch_jobs)
+        # Work on the same git repository is serialized
+        self.package_locks = defaultdict(asyncio.Lock)
+        self.package_tasks = {}
+
+    async def mirror(self, repo):
+        if not repo.mirror_fetches():
+            return
 
+        async with self.fetch_semaphore:
+            try:
+                with track_distgit_health(self.breaker):
+                    await repo.mirror_async()
+            except (GitError, CircuitOpenError) as e:
+                # Failed fetches were already retried
+                logger.warning("Failed to refresh mirror: %s", e)
+                self.breaker.trip(repo.pkg)
+
+    async def get_branches(self, repo, commit):
+        """Returns the branches of repo that contain commit
+
+        A commit that isn't in the mirror is fetched, counting as one of the
+        concurrent fetches, unless this scheduler doesn't fetch.
+        """
+        try:
+            async with self.git_semaphore:
+                return await repo.get_branches_async(commit)
+        except GitError:
+            if not self.fetch:
+                raise
+
+        async with self.fetch_semaphore:
+            with track_distgit_health(self.breaker):
+                return await repo.get_branches_async(commit, try_mirroring=True)
+
+
+class Refresher:
+    """Runs the refreshes of Koji and Bodhi information in Redis concurrently
+
+    Each refresh is a call to a synchronous flatpak_indexer function, so runs
+    in a thread of its own, at most config.refresh_jobs at once. The clients
+    of a session aren't thread-safe, so each call gets a session of its own.
+    A refresh that fails or takes longer than the configured timeout is
+    abandoned, and the information already in Redis is used instead; the
+    backend is then marked unhealthy, and not tried again during the update.
+    (HTTP requests are already retried by flatpak_indexer.)
+
+    The threads are daemon threads: the threads of a concurrent.futures
+    executor are joined when the interpreter exits, so a refresh that hangs
+    would keep the process from exiting long after it was abandoned.
+    """
+
+    def __init__(self, config, breaker: CircuitBreaker, redis_client=None):
+        self.config = config
+        self.breaker = breaker
+        self.redis_client = redis_client
+        self.semaphore = asyncio.Semaphore(config.refresh_jobs)
+
+    def _call(self, func, args):
+        func(_make_indexer_session(self.config, self.redis_client), *args)
+
+    async def _run_in_thread(self, func, args):
+        loop = asyncio.get_running_loop()
+        future = loop.create_future()
+
+        def set_result(exception):
+            # Nothing is waiting any more for a refresh that was abandoned
+            if not future.done():
+                if exception is None:
+                    future.set_result(None)
+                else:
+                    future.set_exception(exception)
+
+        def run():
+            try:
+                self._call(func, args)
+            except Exception as e:
+                exception = e
+            else:
+                exception = None
 
-def _update_to_json(update, include_details=False):
-    result = {
-        'id': update.update_id,
-        'status': update.status,
-        'type': update.type,
-    }
+            try:
+                loop.call_soon_threadsafe(set_result, exception)
+            except RuntimeError:
+                # The event loop has been closed
+                pass
+
+        async with self.semaphore:
+            threading.Thread(target=run, name='refresh-' + func.__name__, daemon=True).start()
+            await future
+
+    async def refresh(self, func, *args):
+        # flatpak_indexer.koji_query, flatpak_indexer.bodhi_query
+        backend = func.__module__
+        if not self.breaker.is_healthy(backend):
+            logger.warning("Skipping %s, using cached information", func.__name__)
+            return
 
-    if include_details:
-        result['user_name'] = update.user_name
-        result['date_submitted'] = _time_to_json(update.date_submitted)
+        try:
+            await asyncio.wait_for(self._run_in_thread(func, args),
+                                   self.config.refresh_timeout.total_seconds())
+        except asyncio.TimeoutError:
+            logger.warning("%s timed out, using cached information", func.__name__)
+            self.breaker.trip(backend)
+        except Exception:
+            logger.exception("%s failed, using cached information", func.__name__)
+            self.breaker.trip(backend)
 
-    return result
 
+def refresh_update_statuses(session: Session, update_ids):
+    """Refreshes the cached status of each of a set of Bodhi updates
 
-class PackageBuildInvestigationItem:
-    def __init__(self, commit, build, update, is_release_version):
-        self.commit = commit
-        self.build = build
-        self.update = update
-        self.is_release_version = is_release_version
+    After a push, hundreds of updates change at once; rather than refreshing
+    them one after another, they are refreshed config.refresh_jobs at a time.
+    Like other refreshes, if Bodhi fails, the cached statuses are used.
+    """
+    refresher = Refresher(session.config, session.breaker, session.redis_client)
 
-    def to_json(self):
-        result = {
-            'commit': self.commit,
-            'build': _build_to_json(self.build),
-        }
-        if self.update is not None:
-            result['update'] = _update_to_json(self.update)
+    async def refresh_all():
+        await asyncio.gather(*(refresher.refresh(refresh_update_status, update_id)
+                               for update_id in sorted(update_ids)))
 
-        return result
+    asyncio.run(refresh_all())
 
 
 def _get_commit(build):
@@ -90,25 +211,26 @@ def _get_commit(build):
 class PackageBuildInvestigation:
     def __init__(
         self, build: PackageBuildModel, module_build: ModuleBuildModel | None,
-        module_stream, fallback_branch: str | None
+        rpm_refs: Dict[str, str] | None, fallback_branch: str | None
     ):
         self.build = build
         self.module_build = module_build
-        self.module_stream = module_stream
+        # rpm component name => ref, from the modulemd of module_build
+        self.rpm_refs = rpm_refs
         self.fallback_branch = fallback_branch
         self.commit = _get_commit(build)
         self.branch = None
-        self.items = []
+        self.items: List[HistoryItem] = []
+        self._result = None
 
-    def find_branch(self, session: Session, repo):
-        if self.module_stream is not None:
+    async def find_branch(self, session: Session, scheduler: Scheduler, repo):
+        if self.rpm_refs is not None:
             # extract a ref from the modulemd
-            rpm_component = self.module_stream.get_rpm_component(self.build.nvr.name)
-            if rpm_component is None:
+            ref = self.rpm_refs.get(self.build.nvr.name)
+            if ref is None:
                 raise RuntimeError(f"Cannot find {self.build.nvr} in the modulemd")
 
-            ref = rpm_component.get_ref()
-            branches = repo.get_branches(ref, try_mirroring=True)
+            branches = await scheduler.get_branches(repo, ref)
             if ref in branches:
                 return ref
 
@@ -134,11 +256,11 @@ class PackageBuildInvestigation:
 
             return self.fallback_branch
 
-    def investigate(self, session: Session):
+    async def investigate_async(self, session: Session, scheduler: Scheduler):
         package_name = self.build.nvr.name
         repo = session.distgit.repo('rpms/' + package_name)
 
-        self.branch = self.find_branch(session, repo)
+        self.branch = await self.find_branch(session, scheduler, repo)
 
         matching_releases = [r for r in session.fedora_releases if r.branch == self.branch]
         if len(matching_releases) > 0:
@@ -170,13 +292,13 @@ class PackageBuildInvestigation:
                         logger.warning("Ignoring build %s without source", build_nvr)
                         continue
                     c = _get_commit(build)
-                    c_branches = repo.get_branches(c, try_mirroring=True)
+                    c_branches = await scheduler.get_branches(repo, c)
                     if self.branch in c_branches:
                         commits[c] = (update, build)
 
         tag_builds = query_tag_builds(session, release.tag,
                                       self.build.nvr.name)
-        tag_builds.sort(reverse=True)
+        tag_builds.sort(key=nvr_sort_key, reverse=True)
         if len(tag_builds) == 0:
             # Package introduced in updates, so just refer to the update builds
             tag_build_commit = None
@@ -191,7 +313,8 @@ class PackageBuildInvestigation:
         if self.commit not in commits:
             commits[self.commit] = (None, self.build)
 
-        nvr_order = sorted(commits.keys(), key=lambda k: commits[k][1].nvr, reverse=True)
+        nvr_order = sorted(commits.keys(), key=lambda k: nvr_sort_key(commits[k][1].nvr),
+                           reverse=True)
 
         git_commits = commits.keys()
         if None in git_commits:
@@ -203,7 +326,8 @@ class PackageBuildInvestigation:
             ordered_commits = nvr_order
         else:
             try:
-                ordered_commits = repo.order(commits.keys())
+                async with scheduler.git_semaphore:
+                    ordered_commits = await repo.order_async(commits.keys())
                 ordered_commits.reverse()
 
                 if nvr_order != ordered_commits:
@@ -219,26 +343,28 @@ class PackageBuildInvestigation:
         for c in ordered_commits:
             c_update, c_build = commits[c]
             if c_update and (c_update.status == 'stable' or c_update.status == 'testing'):
-                self.items.append(PackageBuildInvestigationItem(c, c_build, c_update,
-                                                                c == tag_build_commit))
+                self.items.append(HistoryItem(c, BuildSummary.from_model(c_build),
+                                              UpdateSummary.from_model(c_update),
+                                              c == tag_build_commit))
             elif c == tag_build_commit:
-                self.items.append(PackageBuildInvestigationItem(c, c_build, None, True))
+                self.items.append(HistoryItem(c, BuildSummary.from_model(c_build), None, True))
             elif c == self.commit:
-                self.items.append(PackageBuildInvestigationItem(c, self.build, None, False))
+                self.items.append(HistoryItem(c, BuildSummary.from_model(self.build), None, False))
 
             if c == self.commit:
                 break
 
-    def to_json(self):
-        result = {
-            'build': _build_to_json(self.build),
-            'branch': self.branch,
-            'commit': self.commit,
-            'history': self.items,
-        }
-        if self.module_build:
-            result['module_build'] = _build_to_json(self.module_build)
-        return result
+    def result(self):
+        # Package investigations are shared between Flatpak builds, so share the results too
+        if self._result is None:
+            module_build = self.module_build
+            self._result = PackageResult(
+                BuildSummary.from_model(self.build),
+                BuildSummary.from_model(module_build) if module_build else None,
+                self.branch, self.commit, self.items
+            )
+
+        return self._result
 
 
 class FlatpakBuildInvestigation:
@@ -246,11 +372,10 @@ class FlatpakBuildInvestigation:
         self.build = build
         self.update = update
         self.package_investigations = []
-        self.module_to_module_stream = {}
 
     def find_module(self, session: Session, package_build_nvr):
         module_build = None
-        module_stream = None
+        rpm_refs = None
         for mb_nvr in self.build.module_builds:
             mb = session.build_cache.get_module_build(mb_nvr)
             for binary_package in mb.package_builds:
@@ -258,18 +383,31 @@ class FlatpakBuildInvestigation:
                     module_build = mb
 
         if module_build is not None:
-            module_stream = self.module_to_module_stream.get(module_build.nvr)
-            if module_stream is None:
-                module_index = Modulemd.ModuleIndex.new()
-                module_index.update_from_string(module_build.modulemd, strict=False)
-                module_stream = module_index \
-                    .get_module(module_build.nvr.name) \
-                    .get_streams_by_stream_name(module_build.nvr.version)[0]
-                self.module_to_module_stream[module_build.nvr] = module_stream
+            rpm_refs = session.module_stream_cache.get(module_build.nvr)
+            if rpm_refs is None:
+                rpm_refs = get_rpm_refs(module_build.modulemd,
+                                        module_build.nvr.name, module_build.nvr.version)
+                session.module_stream_cache[module_build.nvr] = rpm_refs
+
+        return module_build, rpm_refs
+
+    async def _investigate_package(self, session: Session, scheduler: Scheduler,
+                                   package_investigation: PackageBuildInvestigation):
+        package_name = package_investigation.build.nvr.name
+        repo_name = 'rpms/' + package_name
+        async with scheduler.package_locks[package_name]:
+            scheduler.breaker.check(repo_name)
+            try:
+                await package_investigation.investigate_async(session, scheduler)
+            except GitError:
+                scheduler.breaker.record_failure(repo_name)
+                raise
+            scheduler.breaker.record_success(repo_name)
 
-        return module_build, module_stream
+        return package_investigation
 
-    def investigate(self, session: Session):
+    async def investigate_async(self, session: Session, scheduler: Scheduler):
+        tasks = []
         for binary_package in self.build.package_builds:
             # Find the module that this package comes from, if any
 
@@ -278,7 +416,7 @@ class FlatpakBuildInvestigation:
             flatpak_name = self.build.nvr.name
             flatpak_stream = self.build.nvr.version
 
-            module_build, module_stream = self.find_module(session, package_build.nvr)
+            module_build, rpm_refs = self.find_module(session, package_build.nvr)
             if module_build is None:
                 if flatpak_name != 'flatpak-runtime' and flatpak_name != 'flatpak-sdk':
                     raise RuntimeError(
@@ -290,28 +428,27 @@ class FlatpakBuildInvestigation:
             key = (package_build.nvr,
                    module_build.nvr if module_build else None,
                    fallback_branch)
-            package_investigation = session.package_investigation_cache.get(key)
-            if package_investigation is None:
+
+            # The same package might be shared by many Flatpak builds
+            task = scheduler.package_tasks.get(key)
+            if task is None:
                 package_investigation = PackageBuildInvestigation(package_build,
-                                                                  module_build, module_stream,
+                                                                  module_build, rpm_refs,
                                                                   fallback_branch)
-                package_investigation.investigate(session)
-                session.package_investigation_cache[key] = package_investigation
+                task = asyncio.ensure_future(
+                    self._investigate_package(session, scheduler, package_investigation)
+                )
+                scheduler.package_tasks[key] = task
 
-            self.package_investigations.append(package_investigation)
+            tasks.append(task)
 
+        self.package_investigations += await asyncio.gather(*tasks)
         self.package_investigations.sort(key=lambda x: x.build.nvr.name)
 
-    def to_json(self):
-        result = {
-            'build': _build_to_json(self.build, include_details=True),
-            'packages': self.package_investigations
-        }
-
-        if self.update is not None:
-            result['update'] = _update_to_json(self.update, include_details=True)
-
-        return result
+    def result(self):
+        return FlatpakBuildResult(BuildSummary.from_model(self.build),
+                                  UpdateSummary.from_model(self.update),
+                                  [pi.result() for pi in self.package_investigations])
 
 
 class FlatpakInvestigation:
@@ -319,17 +456,23 @@ class FlatpakInvestigation:
         self.name = name
         self.module_only = module_only
         self.build_investigations: List[FlatpakBuildInvestigation] = []
+        # Collected by NVR while investigating, then sorted into build_investigations
+        self._build_investigations_by_nvr: Dict[str, FlatpakBuildInvestigation] = {}
+        # Set if investigating failed because of a problem with git
+        self.stale = False
 
     def _add_build_investigation(self, build: FlatpakBuildModel, update=None):
-        for bi in self.build_investigations:
-            if bi.build.nvr == build.nvr:
-                if bi.update is None:
-                    bi.update = update
-                return
-
-        self.build_investigations.append(FlatpakBuildInvestigation(build, update))
-
-        self.build_investigations.sort(key=lambda i: i.build.nvr, reverse=True)
+        # The first update for a build is kept, unless it's None
+        bi = self._build_investigations_by_nvr.get(build.nvr)
+        if bi is None:
+            self._build_investigations_by_nvr[build.nvr] = FlatpakBuildInvestigation(build, update)
+        elif bi.update is None:
+            bi.update = update
+
+    def _sort_build_investigations(self):
+        self.build_investigations = sorted(self._build_investigations_by_nvr.values(),
+                                           key=lambda i: nvr_sort_key(i.build.nvr),
+                                           reverse=True)
 
     def _add_updates(self, session: Session):
         most_recent_testing = {}
@@ -349,11 +492,11 @@ class FlatpakInvestigation:
                     self._add_build_investigation(build, update)
                 elif update.status == 'testing':
                     mrt_build, _ = most_recent_testing.get(stream, (None, None))
-                    if mrt_build is None or mrt_build.nvr < build.nvr:
+                    if mrt_build is None or nvr_sort_key(mrt_build.nvr) < nvr_sort_key(build.nvr):
                         most_recent_testing[stream] = (build, update)
                 elif update.status == 'stable':
                     mrs_build, _ = most_recent_stable.get(stream, (None, None))
-                    if mrs_build is None or mrs_build.nvr < build.nvr:
+                    if mrs_build is None or nvr_sort_key(mrs_build.nvr) < nvr_sort_key(build.nvr):
                         most_recent_stable[stream] = (build, update)
 
         for build, update in most_recent_stable.values():
@@ -366,36 +509,123 @@ class FlatpakInvestigation:
         if len(builds) == 0:
             return
 
-        most_recent = max(builds, key=lambda build: build.nvr)
+        most_recent = max(builds, key=lambda build: nvr_sort_key(build.nvr))
         self._add_build_investigation(most_recent)
 
     def investigate(self, session: Session):
         self._add_updates(session)
         self._add_most_recent_build(session)
+        self._sort_build_investigations()
 
-    def list_packages(self, session: Session):
-        result = set()
+    def list_build_packages(self, session: Session):
+        """Returns a dictionary of Flatpak build NVR => names of the packages in the build"""
+        result = {}
         for bi in self.build_investigations:
+            packages = result[bi.build.nvr] = set()
             for binary_package in bi.build.package_builds:
                 package_build = session.build_cache.get_package_build(binary_package.source_nvr)
-                result.add(package_build.nvr.name)
+                packages.add(package_build.nvr.name)
 
         return result
 
-    def to_json(self):
-        return {
-            'name': self.name,
-            'builds': self.build_investigations
-        }
+    def list_packages(self, session: Session):
+        return set().union(*self.list_build_packages(session).values())
+
+    def result(self):
+        if self.stale:
+            return FlatpakResult(self.name, [], stale=True)
+
+        return FlatpakResult(self.name, [bi.result() for bi in self.build_investigations])
+
+
+# Session for the Flatpaks investigated in a worker process
+_worker_session: Session | None = None
+
+
+def _init_worker(config, distgit, unhealthy):
+    global _worker_session
+    _worker_session = Session(config, distgit)
+    _worker_session.breaker.unhealthy.update(unhealthy)
+
+
+def _make_shards(names, flatpak_packages, jobs):
+    # Flatpaks that share packages go in the same shard where possible, so
+    # that a package is investigated by as few workers as possible; shards
+    # are kept to about the same number of Flatpaks.
+    max_size = -(-len(names) // jobs)
+    shards = [[] for _ in range(jobs)]
+    shard_packages = [set() for _ in range(jobs)]
+
+    for name in sorted(names, key=lambda n: len(flatpak_packages.get(n, ())), reverse=True):
+        packages = flatpak_packages.get(name, set())
+        shard = max((i for i in range(jobs) if len(shards[i]) < max_size),
+                    key=lambda i: (len(packages & shard_packages[i]), -len(shards[i])))
+        shards[shard].append(name)
+        shard_packages[shard] |= packages
+
+    return shards
+
+
+def _investigate_shard(names):
+    investigation = Investigation()
+    for name in names:
+        flatpak_investigation = FlatpakInvestigation(name)
+        flatpak_investigation.investigate(_worker_session)
+        investigation.flatpak_investigations.append(flatpak_investigation)
+
+    # Only the main process writes to the mirrors
+    asyncio.run(investigation._investigate_builds_async(_worker_session, fetch=False))
+
+    return [i.result() for i in investigation.flatpak_investigations]
 
 
 class Investigation:
     def __init__(self):
         self.flatpak_investigations = []
+        # Set instead of flatpak_investigations when investigating in worker processes
+        self.flatpak_results = None
+        # Flatpak name => names of the packages in its builds
+        self.flatpak_packages = {}
+
+    def investigate(self, session: Session, jobs=1, on_partial_result=None,
+                    changed_flatpaks=frozenset()):
+        """Investigates all Flatpaks
+
+        If on_partial_result is passed, Flatpaks that contain packages with
+        pending or testing security updates, and the Flatpaks named in
+        changed_flatpaks, are investigated first, and on_partial_result is
+        called with the result for just them. This isn't done when
+        investigating with multiple jobs.
+        """
+        if jobs == 1:
+            asyncio.run(self.investigate_async(session, on_partial_result=on_partial_result,
+                                               changed_flatpaks=changed_flatpaks))
+        else:
+            asyncio.run(self._refresh_async(session))
+            self._investigate_builds_sharded(session, jobs)
+
+    async def investigate_async(self, session: Session, on_partial_result=None,
+                                changed_flatpaks=frozenset()):
+        await self._refresh_async(session)
+        await self._investigate_builds_async(session, on_partial_result=on_partial_result,
+                                             changed_flatpaks=changed_flatpaks)
+
+    async def _refresh_async(self, session: Session):
+        scheduler = Scheduler(session.config.git_jobs, session.config.fetch_jobs, session.breaker)
+        refresher = Refresher(session.config, session.breaker, session.redis_client)
+        await self._refresh_with(session, scheduler, refresher)
+
+    async def _refresh_with(self, session: Session, scheduler: Scheduler, refresher: Refresher):
+        # The contents of relevant tags don't depend on anything else, so
+        # refresh them in the background
+        tag_refreshes = [
+            asyncio.ensure_future(refresher.refresh(refresh_tag_builds, release.tag))
+            for release in session.fedora_releases
+            if release.status != ReleaseStatus.EOL
+        ]
 
-    def investigate(self, session: Session):
         # Make sure we have the most recent information about Flatpak updates
-        refresh_all_updates(session, 'flatpak')
+        await refresher.refresh(refresh_all_updates, 'flatpak')
 
         flatpak_names = set()
         for update in list_updates(session, 'flatpak'):
@@ -407,34 +637,128 @@ class Investigation:
             self.flatpak_investigations.append(investigation)
 
         # Make sure we have the most recent information about Flatpak builds
-        refresh_flatpak_builds(session, [i.name for i in self.flatpak_investigations])
-
-        # And about the contents of relevant tags
-        for release in session.fedora_releases:
-            if release.status != ReleaseStatus.EOL:
-                refresh_tag_builds(session, release.tag)
+        await refresher.refresh(refresh_flatpak_builds,
+                                [i.name for i in self.flatpak_investigations])
+        await asyncio.gather(*tag_refreshes)
 
         packages = set()
+        build_packages = {}
         for investigation in self.flatpak_investigations:
             investigation.investigate(session)
-            packages.update(investigation.list_packages(session))
+            flatpak_build_packages = investigation.list_build_packages(session)
+            build_packages.update(flatpak_build_packages)
+            self.flatpak_packages[investigation.name] = \
+                set().union(*flatpak_build_packages.values())
+            packages.update(self.flatpak_packages[investigation.name])
+
+        update_package_index(session.redis_client, build_packages)
+
+        # Now make sure we have the most recent git for relevant packages, and
+        # the most recent information about their updates
+        await asyncio.gather(
+            refresher.refresh(refresh_updates, 'rpm', list(packages)),
+            *(scheduler.mirror(session.distgit.repo('rpms/' + p)) for p in sorted(packages))
+        )
+
+    def _find_security_flatpaks(self, session: Session):
+        security_packages = set()
+        for package in sorted(set().union(*self.flatpak_packages.values())):
+            for update in list_updates(session, 'rpm', package):
+                if update.type == 'security' and update.status in ('pending', 'testing'):
+                    security_packages.add(package)
+                    break
+
+        return {name for name, packages in self.flatpak_packages.items()
+                if not security_packages.isdisjoint(packages)}
+
+    async def _investigate_builds_async(self, session: Session, on_partial_result=None,
+                                        changed_flatpaks=frozenset(), fetch=True):
+        scheduler = Scheduler(session.config.git_jobs, session.config.fetch_jobs, session.breaker,
+                              fetch=fetch)
+
+        if on_partial_result is not None:
+            first_flatpaks = self._find_security_flatpaks(session) | set(changed_flatpaks)
+        else:
+            first_flatpaks = set()
+
+        first = [i for i in self.flatpak_investigations if i.name in first_flatpaks]
+        rest = [i for i in self.flatpak_investigations if i.name not in first_flatpaks]
+
+        for group in (first, rest):
+            await asyncio.gather(*(
+                self._investigate_flatpak_async(session, scheduler, investigation)
+                for investigation in group
+            ))
+
+            if group is first and len(first) > 0:
+                logger.info("Investigated Flatpaks with security updates or changes first: %s",
+                            ", ".join(i.name for i in first))
+                on_partial_result(self.result(first))
+
+    async def _investigate_flatpak_async(self, session: Session, scheduler: Scheduler,
+                                         investigation: FlatpakInvestigation):
+        # A problem with one git repository shouldn't keep the rest from being published
+        try:
+            await asyncio.gather(*(
+                bi.investigate_async(session, scheduler)
+                for bi in investigation.build_investigations
+            ))
+        except (GitError, CircuitOpenError) as e:
+            logger.warning("%s: Reporting as stale: %s", investigation.name, e)
+            investigation.stale = True
+
+    def _investigate_builds_sharded(self, session: Session, jobs):
+        # The Redis cache and the git mirrors were refreshed before forking,
+        # and the workers only read from them.
+        names = [i.name for i in self.flatpak_investigations]
+        shards = _make_shards(names, self.flatpak_packages, jobs)
+
+        # fork, rather than spawn, so that workers don't redo the startup work
+        with ProcessPoolExecutor(max_workers=jobs,
+                                 mp_context=multiprocessing.get_context('fork'),
+                                 initializer=_init_worker,
+                                 initargs=(session.config, session.distgit,
+                                           session.breaker.unhealthy)) as executor:
+            results = {}
+            for shard_result in executor.map(_investigate_shard, shards):
+                for flatpak_result in shard_result:
+                    results[flatpak_result.name] = flatpak_result
+
+        # A Flatpak that couldn't be investigated from the mirrors as they are -
+        # usually because a commit has to be fetched - is investigated again here
+        retry = [i for i in self.flatpak_investigations if results[i.name].stale]
+        if retry:
+            logger.info("Investigating again with fetching: %s", ", ".join(i.name for i in retry))
+
+            async def investigate_retry():
+                scheduler = Scheduler(session.config.git_jobs, session.config.fetch_jobs,
+                                      session.breaker)
+                await asyncio.gather(*(self._investigate_flatpak_async(session, scheduler, i)
+                                       for i in retry))
+
+            asyncio.run(investigate_retry())
+            for investigation in retry:
+                results[investigation.name] = investigation.result()
 
-        # Now make sure we have the most recent git for relevant packages
-        for p in sorted(packages):
-            session.distgit.repo('rpms/' + p).mirror()
+        self.flatpak_investigations = []
+        self.flatpak_results = [results[name] for name in names]
 
-        # Make sure we have the most recent information about relevant packages
-        refresh_updates(session, 'rpm', list(packages))
+    def result(self, flatpak_investigations=None):
+        """Returns the compact form of the investigation, for output and to keep around
 
-        for investigation in self.flatpak_investigations:
-            for bi in investigation.build_investigations:
-                bi.investigate(session)
+        If flatpak_investigations is passed, the result only includes those Flatpaks.
+        """
+        if flatpak_investigations is not None:
+            flatpaks = [i.result() for i in flatpak_investigations]
+        elif self.flatpak_results is not None:
+            flatpaks = self.flatpak_results
+        else:
+            flatpaks = [i.result() for i in self.flatpak_investigations]
+
+        return InvestigationResult(datetime.utcnow(), flatpaks)
 
     def to_json(self):
-        return {
-            'date_updated': _time_to_json(datetime.utcnow()),
-            'flatpaks': self.flatpak_investigations,
-        }
+        return self.result().to_json()
 
 
 class UpdateJsonEncoder(json.JSONEncoder):
@@ -21,9 +21,18 @@ class MockDistGitRepo:
     def exists(self):
         return self.pkg != 'NOTEXIST'
 
+    def mirror_fetches(self, mirror_always=False):
+        return True
+
     def mirror(self, mirror_always=False):
         self._load()
 
+    async def mirror_async(self, mirror_always=False):
+        self.mirror(mirror_always=mirror_always)
+
+    def mirror_branches(self, branches):
+        self._load()
+
     def get_branches(self, commit, try_mirroring=False):
         self._load()
 
@@ -40,6 +49,9 @@ class MockDistGitRepo:
 
         return result
 
+    async def get_branches_async(self, commit, try_mirroring=False):
+        return self.get_branches(commit, try_mirroring=try_mirroring)
+
     def rev_parse(self, ref):
         self._load()
 
@@ -63,12 +75,15 @@ class MockDistGitRepo:
 
         raise RuntimeError(f"{commits} not all found on the same branch")
 
+    async def order_async(self, commits):
+        return self.order(commits)
+
 
 class MockDistGit:
     def __init__(self):
         pass
 
-    def mirror_all(self):
+    def mirror_all(self, breaker):
         pass
 
     def repo(self, pkg):
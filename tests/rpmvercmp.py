@@ -0,0 +1,74 @@
+def rpmvercmp(a, b):
+    """Compares two version strings like rpm, returning -1, 0, or 1
+
+    This is a direct port of rpmvercmp(), for validating nvr_sort_key()
+    against, and for comparing its speed with.
+    """
+    one = two = 0
+
+    def skip_separators(s, i):
+        while i < len(s) and not (s[i].isascii() and s[i].isalnum()) and s[i] not in '~^':
+            i += 1
+        return i
+
+    def segment(s, i, isnum):
+        while i < len(s) and s[i].isascii() and (s[i].isdigit() if isnum else s[i].isalpha()):
+            i += 1
+        return i
+
+    while one < len(a) or two < len(b):
+        one = skip_separators(a, one)
+        two = skip_separators(b, two)
+
+        c1 = a[one] if one < len(a) else ''
+        c2 = b[two] if two < len(b) else ''
+
+        if c1 == '~' or c2 == '~':
+            if c1 != '~':
+                return 1
+            if c2 != '~':
+                return -1
+            one += 1
+            two += 1
+            continue
+
+        if c1 == '^' or c2 == '^':
+            if c1 == '':
+                return -1
+            if c2 == '':
+                return 1
+            if c1 != '^':
+                return 1
+            if c2 != '^':
+                return -1
+            one += 1
+            two += 1
+            continue
+
+        if c1 == '' or c2 == '':
+            break
+
+        isnum = c1.isdigit()
+        end1 = segment(a, one, isnum)
+        end2 = segment(b, two, isnum)
+        if end2 == two:
+            # Segments of different types, numeric is newer
+            return 1 if isnum else -1
+
+        seg1 = a[one:end1]
+        seg2 = b[two:end2]
+        one, two = end1, end2
+
+        if isnum:
+            seg1 = seg1.lstrip('0')
+            seg2 = seg2.lstrip('0')
+            if len(seg1) != len(seg2):
+                return 1 if len(seg1) > len(seg2) else -1
+
+        if seg1 != seg2:
+            return 1 if seg1 > seg2 else -1
+
+    if one >= len(a) and two >= len(b):
+        return 0
+
+    return -1 if one >= len(a) else 1
@@ -0,0 +1,45 @@
+'use strict';
+
+// Checks the fallback verdicts in web/verdicts.js against the cases that
+// tests/test_results.py checks the Python code with.
+
+const assert = require('assert');
+
+const verdicts = require('../web/verdicts.js');
+const cases = require('./verdicts.json');
+
+for (const testCase of cases) {
+    const build = testCase.build;
+    const expected = testCase.expected;
+
+    assert.deepStrictEqual(build.packages.map(verdicts.isPackageGood),
+        expected.package_good, testCase.description);
+    assert.strictEqual(verdicts.isFlatpakBuildGood(build),
+        expected.good, testCase.description);
+    assert.strictEqual(verdicts.hasFlatpakBuildSecurityUpdates(build),
+        expected.has_security_updates, testCase.description);
+    assert.deepStrictEqual(verdicts.flatpakBuildOutOfDatePackages(build),
+        expected.out_of_date_packages, testCase.description);
+
+    const flatpak = {name: 'eog', builds: [build]};
+    assert.strictEqual(verdicts.isFlatpakGood(flatpak),
+        expected.good, testCase.description);
+    assert.strictEqual(verdicts.hasFlatpakSecurityUpdates(flatpak),
+        expected.has_security_updates, testCase.description);
+}
+
+// Verdicts in the output are used when present
+const build = {
+    packages: [],
+    good: false,
+    has_security_updates: true,
+    out_of_date_packages: ['eog'],
+};
+assert.strictEqual(verdicts.isFlatpakBuildGood(build), false);
+assert.strictEqual(verdicts.hasFlatpakBuildSecurityUpdates(build), true);
+assert.strictEqual(verdicts.flatpakBuildStatusString(build), 'Out-of-date: eog');
+
+// A stale Flatpak that was never checked is neither good nor bad
+assert.strictEqual(verdicts.isFlatpakGood({name: 'eog', builds: [], stale: true}), null);
+
+console.log(`${cases.length} verdict cases passed`);
@@ -1,5 +1,9 @@
 from copy import deepcopy
+from datetime import datetime, timedelta
+import json
 import sys
+import tracemalloc
+from types import SimpleNamespace
 from unittest.mock import patch
 
 from click.testing import CliRunner
@@ -12,7 +16,13 @@ import yaml
 
 
 from flatpak_status.cli import cli, Config
-from .distgit_mock import mock_distgit
+from flatpak_status.distgit import GitError
+from flatpak_status.results import (
+    BuildSummary, FlatpakBuildResult, FlatpakResult, HistoryItem,
+    InvestigationResult, PackageResult, UpdateSummary
+)
+from flatpak_status.snapshot import get_snapshot_path, save_snapshot
+from .distgit_mock import mock_distgit, MockDistGit, MockDistGitRepo
 from .fedora_monitor_mock import mock_fedora_monitor
 
 
@@ -71,6 +81,131 @@ def test_daemon(tmp_path, config, bodhi_changed, distgit_changed):
         assert (tmp_path / "status.json").exists()
 
 
+def make_warm_start(date_updated):
+    def make_build(build_id, nvr):
+        return BuildSummary.from_model(SimpleNamespace(
+            build_id=build_id, nvr=nvr, user_name='kalev',
+            completion_time=datetime(2018, 9, 4, 9, 37, 19)
+        ))
+
+    def make_update(update_id, status):
+        return UpdateSummary.from_model(SimpleNamespace(
+            update_id=update_id, status=status, type='bugfix',
+            user_name='kalev', date_submitted=datetime(2018, 9, 4, 10, 0, 0)
+        ))
+
+    old_build = make_build(1, 'eog-3.28.3-1.fc29')
+    package = PackageResult(old_build, None, 'f29', 'aaaa', [
+        HistoryItem('bbbb', make_build(2, 'eog-3.28.4-1.fc29'),
+                    make_update('FEDORA-2018-1a0cf961a1', 'testing'), False),
+        HistoryItem('aaaa', old_build, make_update('FEDORA-2018-ac69655fa3', 'stable'), True),
+    ])
+
+    return InvestigationResult(date_updated, [
+        FlatpakResult('eog', [
+            FlatpakBuildResult(make_build(3, 'eog-master-20181128204005.1'), None, [package])
+        ]),
+    ])
+
+
+@mock_bodhi
+@mock_distgit
+@mock_fedora_monitor
+@mock_koji
+@mock_redis
+@pytest.mark.parametrize('snapshot_age,warm', [
+    (None, False),
+    (timedelta(hours=1), True),
+    (timedelta(days=2), False),
+])
+def test_daemon_warm_start(tmp_path, config, snapshot_age, warm):
+    config_object = Config.from_path(config)
+    mock_fedora_monitor = fedora_monitor.FedoraMonitor(config_object)
+
+    # The monitor doesn't know what changed before it started
+    mock_fedora_monitor.get_bodhi_changed.return_value = (None, 42)
+    mock_fedora_monitor.get_distgit_changed.return_value = (None, 42)
+
+    if snapshot_age is not None:
+        save_snapshot(get_snapshot_path(config_object),
+                      make_warm_start(datetime.utcnow() - snapshot_age))
+
+    # For each update: whether there was already output, and how many times
+    # the caches had been reset and the mirrors refreshed
+    updates = []
+
+    def mock_investigate(*args, **kwargs):
+        updates.append(((tmp_path / "status.json").exists(),
+                        reset_update_cache.call_count, mirror_all.call_count))
+
+    def mock_sleep(secs):
+        sys.exit(42)
+
+    runner = CliRunner()
+
+    with patch('time.sleep', side_effect=mock_sleep), \
+         patch('flatpak_indexer.bodhi_query.reset_update_cache') as reset_update_cache, \
+         patch('flatpak_status.update.refresh_update_statuses') as refresh_update_statuses, \
+         patch.object(MockDistGit, 'mirror_all') as mirror_all, \
+         patch.object(MockDistGitRepo, 'mirror_branches') as mirror_branches, \
+         patch('flatpak_status.update.Investigation.investigate',
+               side_effect=mock_investigate):
+        result = runner.invoke(cli, ['--config-file', config, 'daemon'],
+                               catch_exceptions=False)
+        assert result.exit_code == 42
+
+    if warm:
+        # Published right away, then only what the last update looked at is refreshed
+        assert updates == [(True, 0, 0)]
+        assert refresh_update_statuses.call_args[0][1] == {'FEDORA-2018-1a0cf961a1'}
+        assert mirror_branches.call_count == 1
+    else:
+        assert updates == [(False, 1, 1)]
+        refresh_update_statuses.assert_not_called()
+        mirror_branches.assert_not_called()
+
+
+@mock_bodhi
+@mock_distgit
+@mock_fedora_monitor
+@mock_koji
+@mock_redis
+@pytest.mark.parametrize('max_update_refreshes,reset', [
+    (200, False),
+    (1, True),
+])
+def test_daemon_bodhi_burst(tmp_path, config, max_update_refreshes, reset):
+    with open(config) as f:
+        config_data = yaml.safe_load(f)
+    config_data['max_update_refreshes'] = max_update_refreshes
+    with open(config, 'w') as f:
+        yaml.safe_dump(config_data, f)
+
+    config_object = Config.from_path(config)
+    mock_fedora_monitor = fedora_monitor.FedoraMonitor(config_object)
+
+    bodhi_changed = {'FEDORA-2018-ac69655fa3', 'FEDORA-2018-1a0cf961a1'}
+    mock_fedora_monitor.get_bodhi_changed.return_value = (bodhi_changed, 42)
+    mock_fedora_monitor.get_distgit_changed.return_value = (set(), 42)
+
+    def mock_sleep(secs):
+        sys.exit(42)
+
+    runner = CliRunner()
+
+    with patch('time.sleep', side_effect=mock_sleep), \
+         patch('flatpak_indexer.bodhi_query.reset_update_cache') as reset_update_cache, \
+         patch('flatpak_status.update.refresh_update_statuses') as refresh_update_statuses:
+        result = runner.invoke(cli, ['--config-file', config, 'daemon'],
+                               catch_exceptions=False)
+        assert result.exit_code == 42
+
+    assert reset_update_cache.called == reset
+    assert refresh_update_statuses.called != reset
+    if not reset:
+        assert refresh_update_statuses.call_args[0][1] == bodhi_changed
+
+
 @mock_bodhi
 @mock_distgit
 @mock_fedora_monitor
@@ -92,6 +227,69 @@ def test_daemon_exception(tmp_path, config, caplog):
         assert result.output == ''
 
 
+@mock_bodhi
+@mock_distgit
+@mock_fedora_monitor
+@mock_koji
+@mock_redis
+def test_daemon_refresh_failures(tmp_path, config, caplog):
+    config_object = Config.from_path(config)
+    mock_fedora_monitor = fedora_monitor.FedoraMonitor(config_object)
+
+    mock_fedora_monitor.get_bodhi_changed.return_value = ({'FEDORA-2018-ac69655fa3'}, 42)
+    mock_fedora_monitor.get_distgit_changed.return_value = ({'rpms/eog'}, 42)
+
+    def mock_sleep(secs):
+        sys.exit(42)
+
+    def refresh_update_status(session, update_id):
+        raise RuntimeError("Bodhi is down")
+
+    runner = CliRunner()
+
+    # Failing to refresh doesn't keep the update from being published
+    with patch('time.sleep', side_effect=mock_sleep), \
+         patch('flatpak_status.update.refresh_update_status', refresh_update_status), \
+         patch.object(MockDistGitRepo, 'mirror_branches',
+                      side_effect=GitError("rpms/eog: fetch timed out")):
+        result = runner.invoke(cli, ['--config-file', config, 'daemon'],
+                               catch_exceptions=False)
+        assert result.exit_code == 42
+
+    assert "refresh_update_status failed, using cached information" in caplog.text
+    assert "Failed to update git mirror: rpms/eog: fetch timed out" in caplog.text
+
+    # The Flatpaks with the repository that couldn't be updated are stale
+    with open(tmp_path / "status.json") as f:
+        flatpaks = {f['name']: f for f in json.load(f)['flatpaks']}
+    assert flatpaks['eog'].get('stale')
+
+
+@mock_bodhi
+@mock_distgit
+@mock_fedora_monitor
+@mock_koji
+@mock_redis
+def test_daemon_trace_memory(tmp_path, config, caplog):
+    runner = CliRunner()
+
+    def mock_sleep(secs):
+        sys.exit(42)
+
+    try:
+        with patch('time.sleep', side_effect=mock_sleep):
+            result = runner.invoke(cli, ['--config-file', config, '--verbose',
+                                         'daemon', '--trace-memory'],
+                                   catch_exceptions=False)
+            assert result.exit_code == 42
+    finally:
+        tracemalloc.stop()
+
+    assert 'Peak RSS' in caplog.text
+    assert 'NVR sort keys=' in caplog.text
+    assert 'Traced memory' in caplog.text
+
+
 @mock_bodhi
 @mock_distgit
 @mock_koji
@@ -115,3 +313,121 @@ def test_update(tmp_path, config, caplog, verbose):
         assert 'Successfully created json cache' not in caplog.text
 
     assert (tmp_path / "status.json").exists()
+
+
+@mock_bodhi
+@mock_distgit
+@mock_koji
+@mock_redis
+def test_render(tmp_path, config):
+    runner = CliRunner()
+
+    result = runner.invoke(cli, ['--config-file', config, 'render'])
+    assert result.exit_code == 1
+    assert 'No snapshot of an investigation' in result.output
+
+    result = runner.invoke(cli, ['--config-file', config, 'update'], catch_exceptions=False)
+    assert result.exit_code == 0
+
+    with open(tmp_path / "status.json") as f:
+        updated = json.load(f)
+
+    (tmp_path / "status.json").unlink()
+
+    result = runner.invoke(cli, ['--config-file', config, 'render'], catch_exceptions=False)
+    assert result.output == ''
+    assert result.exit_code == 0
+
+    with open(tmp_path / "status.json") as f:
+        rendered = json.load(f)
+
+    assert rendered == updated
+
+    result = runner.invoke(cli, ['--config-file', config, 'render',
+                                 '--output', str(tmp_path / 'rendered.json')],
+                           catch_exceptions=False)
+    assert result.exit_code == 0
+    assert (tmp_path / 'rendered.json').exists()
+
+
+@mock_bodhi
+@mock_distgit
+@mock_koji
+@mock_redis
+def test_which_flatpaks(config):
+    runner = CliRunner()
+
+    result = runner.invoke(cli, ['--config-file', config, 'which-flatpaks', 'exempi'],
+                           catch_exceptions=False)
+    assert result.exit_code == 0
+    assert result.output == ''
+
+    result = runner.invoke(cli, ['--config-file', config, 'update'], catch_exceptions=False)
+    assert result.exit_code == 0
+
+    result = runner.invoke(cli, ['--config-file', config, 'which-flatpaks', 'exempi'],
+                           catch_exceptions=False)
+    assert result.exit_code == 0
+    assert 'eog-master-20181128204005.1\n' in result.output
+
+
+@mock_bodhi
+@mock_distgit
+@mock_koji
+@mock_redis
+def test_query(tmp_path, config):
+    with open(config) as f:
+        config_data = yaml.safe_load(f)
+    config_data['history_db'] = str(tmp_path / 'history.db')
+    with open(config, 'w') as f:
+        yaml.safe_dump(config_data, f)
+
+    runner = CliRunner()
+
+    result = runner.invoke(cli, ['--config-file', config, 'query', 'out-of-date'])
+    assert result.exit_code == 1
+    assert 'history.db does not exist' in result.output
+
+    result = runner.invoke(cli, ['--config-file', config, 'update'], catch_exceptions=False)
+    assert result.exit_code == 0
+
+    result = runner.invoke(cli, ['--config-file', config, 'query', 'flatpak', 'eog'],
+                           catch_exceptions=False)
+    assert result.exit_code == 0
+    assert result.output.startswith('eog: ')
+
+    result = runner.invoke(cli, ['--config-file', config, 'query', 'out-of-date'],
+                           catch_exceptions=False)
+    assert result.exit_code == 0
+
+    result = runner.invoke(cli, ['--config-file', config,
+                                 'query', 'security', '--since', '2019-01-01'],
+                           catch_exceptions=False)
+    assert result.exit_code == 0
+
+
+def test_serve(config):
+    config_object = Config.from_path(config)
+    save_snapshot(get_snapshot_path(config_object),
+                  InvestigationResult(datetime(2019, 2, 6, 0, 0, 0), []))
+
+    def mock_sleep(secs):
+        sys.exit(42)
+
+    runner = CliRunner()
+
+    result = runner.invoke(cli, ['--config-file', config, 'serve'])
+    assert result.exit_code == 1
+    assert 'http_port is not configured' in result.output
+
+    with patch('time.sleep', side_effect=mock_sleep), \
+         patch('flatpak_status.cli.StatusServer') as StatusServer:
+        result = runner.invoke(cli, ['--config-file', config, 'serve', '--port', '8081'],
+                               catch_exceptions=False)
+        assert result.exit_code == 42
+
+    StatusServer.assert_called_once_with('localhost', 8081)
+    server = StatusServer.return_value
+    assert server.start.called
+    published, = server.publish.call_args[0]
+    assert published.date_updated == datetime(2019, 2, 6, 0, 0, 0)
@@ -1,8 +1,15 @@
+import asyncio
 import os
 import shutil
 import tempfile
+from unittest.mock import patch
 
-from flatpak_status.distgit import DistGit, GitRepo
+import pytest
+
+from flatpak_status.distgit import (
+    DistGit, DISTGIT_BACKEND, GitError, GitRepo, MissingCommitError, track_distgit_health
+)
+from flatpak_status.resilience import CircuitBreaker, CircuitOpenError
 
 
 def create_source(source_dir):
@@ -35,6 +42,19 @@ def create_source(source_dir):
     return result
 
 
+def add_commit(source_dir, branch, message):
+    repo = GitRepo(os.path.join(source_dir, 'rpms/eog'))
+
+    repo.do('checkout', '-q', branch)
+    with open(os.path.join(repo.repo_dir, 'eog.spec'), 'a') as f:
+        f.write(message + '\n')
+    repo.do('commit', '-m', message, 'eog.spec')
+    commit = repo.capture('rev-parse', 'HEAD')
+    repo.do('checkout', '-q', 'main')
+
+    return {message: commit}
+
+
 def test_distgit():
     try:
         source_dir = tempfile.mkdtemp()
@@ -47,6 +67,9 @@ def test_distgit():
 
         repo.mirror()
 
+        assert os.path.exists(os.path.join(repo.repo_dir,
+                                           'objects/info/commit-graphs/commit-graph-chain'))
+
         head = repo.rev_parse('HEAD')
         assert head == commits['Commit 2']
 
@@ -57,6 +80,177 @@ def test_distgit():
         ordered = repo.order(unordered)
         assert ordered == [commits[x] for x in ('Commit 1', 'Commit 2', 'Commit 2')]
 
+        commits.update(add_commit(source_dir, 'f29', 'Commit 3'))
+
+        # Already at the announced commit, nothing fetched
+        repo.mirror_branches({'f29': commits['Commit 1'], 'f30': None})
+        assert repo.rev_parse('f29') == commits['Commit 1']
+
+        repo.mirror_branches({'f29': commits['Commit 3'], 'f30': None})
+        assert repo.rev_parse('f29') == commits['Commit 3']
+        assert repo.rev_parse('main') == commits['Commit 2']
+        assert not repo.verify_rev('refs/heads/f30')
+
+    finally:
+        shutil.rmtree(source_dir)
+        shutil.rmtree(mirror_dir)
+
+
+def test_get_branches_fetch():
+    try:
+        source_dir = tempfile.mkdtemp()
+        mirror_dir = tempfile.mkdtemp()
+
+        commits = create_source(source_dir)
+
+        distgit = DistGit(base_url='file://' + source_dir, mirror_dir=mirror_dir,
+                          mirror_existing=False)
+        repo = distgit.repo('rpms/eog')
+        repo.mirror()
+
+        commits.update(add_commit(source_dir, 'f29', 'Commit 3'))
+
+        with pytest.raises(GitError):
+            repo.get_branches(commits['Commit 3'])
+
+        # Failing to reach origin doesn't make the commit count as missing
+        os.rename(source_dir, source_dir + '.unreachable')
+        try:
+            with pytest.raises(GitError):
+                repo.get_branches(commits['Commit 3'], try_mirroring=True)
+        finally:
+            os.rename(source_dir + '.unreachable', source_dir)
+        assert repo.missing_commits == set()
+
+        branches = repo.get_branches(commits['Commit 3'], try_mirroring=True)
+        assert branches == ['f29']
+
+        missing = '0123456789abcdef0123456789abcdef01234567'
+        with pytest.raises(MissingCommitError, match='missing from the repository and origin'):
+            repo.get_branches(missing, try_mirroring=True)
+
+        # Known to be missing, so git isn't run again
+        with patch('asyncio.create_subprocess_exec') as create_subprocess_exec, \
+             pytest.raises(GitError, match='missing from the repository'):
+            distgit.repo('rpms/eog').get_branches(missing, try_mirroring=True)
+        create_subprocess_exec.assert_not_called()
+
+        # Until the mirror is refreshed
+        repo.mirror(mirror_always=True)
+        assert repo.missing_commits == set()
+    finally:
+        shutil.rmtree(source_dir)
+        shutil.rmtree(mirror_dir)
+
+
+def test_order():
+    try:
+        source_dir = tempfile.mkdtemp()
+        mirror_dir = tempfile.mkdtemp()
+
+        commits = create_source(source_dir)
+        for i in range(3, 17):
+            commits.update(add_commit(source_dir, 'main', f'Commit {i}'))
+
+        distgit = DistGit(base_url='file://' + source_dir, mirror_dir=mirror_dir)
+        repo = distgit.repo('rpms/eog')
+        repo.mirror()
+
+        in_order = [commits[f'Commit {i}'] for i in range(1, 17)]
+        unordered = in_order[::2][::-1] + in_order[1::2]
+
+        merge_bases = 0
+        capture_async = repo.capture_async
+
+        async def counting_capture_async(*args):
+            nonlocal merge_bases
+            if args[0] == 'merge-base':
+                merge_bases += 1
+            return await capture_async(*args)
+
+        with patch.object(repo, 'capture_async', side_effect=counting_capture_async):
+            assert repo.order(unordered) == in_order
+
+        # A merge sort of 16 commits needs at most 16 * log2(16) comparisons,
+        # not one for each of the 120 pairs
+        assert merge_bases <= 64
+    finally:
+        shutil.rmtree(source_dir)
+        shutil.rmtree(mirror_dir)
+
+
+def test_timeout_retry(caplog):
+    try:
+        source_dir = tempfile.mkdtemp()
+        mirror_dir = tempfile.mkdtemp()
+
+        create_source(source_dir)
+
+        distgit = DistGit(base_url='file://' + source_dir, mirror_dir=mirror_dir,
+                          timeout=0, fetch_attempts=2, fetch_retry_delay=0)
+
+        # Fetches are retried, then give up
+        repo = distgit.repo('rpms/NOTEXIST')
+        with pytest.raises(GitError):
+            repo.mirror()
+        assert caplog.text.count('retrying in') == 1
+
+        repo = distgit.repo('rpms/eog')
+        repo.mirror()
+
+        # Too short a timeout for anything to finish
+        with pytest.raises(GitError, match='timed out'):
+            asyncio.run(repo.capture_async('rev-parse', 'HEAD'))
+    finally:
+        shutil.rmtree(source_dir)
+        shutil.rmtree(mirror_dir)
+
+
+def test_track_distgit_health():
+    breaker = CircuitBreaker(2)
+
+    # Not having a commit is an answer from dist-git
+    for _ in range(2):
+        with pytest.raises(GitError), track_distgit_health(breaker):
+            raise MissingCommitError("rpms/eog: 0123 is missing from the repository and origin")
+    assert breaker.is_healthy(DISTGIT_BACKEND)
+
+    for _ in range(2):
+        with pytest.raises(GitError), track_distgit_health(breaker):
+            raise GitError("rpms/eog: fetch timed out")
+    assert not breaker.is_healthy(DISTGIT_BACKEND)
+
+    # Nothing more is tried
+    with pytest.raises(CircuitOpenError), track_distgit_health(breaker):
+        assert False
+
+
+def test_mirror_all_unhealthy():
+    try:
+        source_dir = tempfile.mkdtemp()
+        mirror_dir = tempfile.mkdtemp()
+
+        create_source(source_dir)
+        shutil.copytree(os.path.join(source_dir, 'rpms/eog'),
+                        os.path.join(source_dir, 'rpms/aisleriot'))
+
+        distgit = DistGit(base_url='file://' + source_dir, mirror_dir=mirror_dir,
+                          mirror_existing=False)
+        distgit.repo('rpms/aisleriot').mirror()
+        distgit.repo('rpms/eog').mirror()
+
+        breaker = CircuitBreaker(1)
+        distgit.mirror_all(breaker)
+        assert breaker.unhealthy == set()
+
+        # After the first failure, dist-git is marked unhealthy, and the
+        # remaining mirrors aren't tried
+        os.rename(source_dir, source_dir + '.unreachable')
+        try:
+            distgit.mirror_all(breaker)
+        finally:
+            os.rename(source_dir + '.unreachable', source_dir)
+        assert breaker.unhealthy == {DISTGIT_BACKEND, 'rpms/aisleriot'}
     finally:
         shutil.rmtree(source_dir)
         shutil.rmtree(mirror_dir)
@@ -0,0 +1,181 @@
+from datetime import datetime, timedelta
+from types import SimpleNamespace
+
+from flatpak_status.history import HistoryStore
+from flatpak_status.results import (
+    BuildSummary, FlatpakBuildResult, FlatpakResult, HistoryItem,
+    InvestigationResult, PackageResult, UpdateSummary
+)
+
+
+def make_build(build_id, nvr):
+    return BuildSummary.from_model(SimpleNamespace(
+        build_id=build_id, nvr=nvr, user_name='kalev',
+        completion_time=datetime(2018, 9, 4, 9, 37, 19)
+    ))
+
+
+def make_update(update_id, type):
+    return UpdateSummary.from_model(SimpleNamespace(
+        update_id=update_id, status='stable', type=type,
+        user_name='kalev', date_submitted=datetime(2018, 9, 4, 10, 0, 0)
+    ))
+
+
+OLD_BUILD = make_build(1, 'eog-3.28.3-1.fc29')
+NEW_BUILD = make_build(2, 'eog-3.28.4-1.fc29')
+HISTORY = [
+    HistoryItem('bbbb', NEW_BUILD, make_update('FEDORA-2018-2', 'security'), True),
+    HistoryItem('aaaa', OLD_BUILD, make_update('FEDORA-2018-1', 'bugfix'), True),
+]
+FLATPAK_BUILD = make_build(3, 'eog-master-20181128204005.1')
+
+
+def make_result(date_updated, up_to_date=True, stale=False):
+    if up_to_date:
+        package = PackageResult(NEW_BUILD, None, 'f29', 'bbbb', HISTORY)
+    else:
+        package = PackageResult(OLD_BUILD, None, 'f29', 'aaaa', HISTORY)
+
+    return InvestigationResult(date_updated, [
+        FlatpakResult('eog', [FlatpakBuildResult(FLATPAK_BUILD, None, [package])], stale=stale),
+        FlatpakResult('totem', []),
+    ])
+
+
+def test_history(tmp_path):
+    path = str(tmp_path / 'history.db')
+
+    with HistoryStore(path) as store:
+        store.record(make_result(datetime(2019, 2, 1), up_to_date=True))
+        store.record(make_result(datetime(2019, 2, 2), up_to_date=False))
+        store.record(make_result(datetime(2019, 2, 3), up_to_date=False))
+
+        assert store.query_out_of_date()[0].flatpak == 'eog'
+
+    # Reopening an existing database
+    with HistoryStore(path) as store:
+        store.record(make_result(datetime(2019, 2, 4), up_to_date=False, stale=True))
+        store.record(make_result(datetime(2019, 2, 5), up_to_date=True))
+
+        states = store.query_flatpak('eog')
+        assert [(s.good, s.has_security_updates, s.stale, s.since.day, s.until.day)
+                for s in states] == [
+            (True, False, False, 1, 1),
+            (False, True, False, 2, 3),
+            (False, True, True, 4, 4),
+            (True, False, False, 5, 5),
+        ]
+
+        # A Flatpak without builds is trivially up-to-date, and never changes
+        totem, = store.query_flatpak('totem')
+        assert totem.good and (totem.since.day, totem.until.day) == (1, 5)
+
+        assert store.query_out_of_date() == []
+
+        security = store.query_security(datetime(2019, 2, 3, 12), datetime(2019, 2, 10))
+        assert [(s.flatpak, s.since.day) for s in security] == [('eog', 4)]
+
+        # The build's state changed along with the package, but it's always the same build
+        cursor = store.connection.execute(
+            'SELECT nvr, good, first_generation, last_generation FROM build_states ORDER BY id'
+        )
+        assert cursor.fetchall() == [
+            ('eog-master-20181128204005.1', 1, 1, 1),
+            ('eog-master-20181128204005.1', 0, 2, 4),
+            ('eog-master-20181128204005.1', 1, 5, 5),
+        ]
+
+        # History items are stored once for each package state
+        cursor = store.connection.execute(
+            'SELECT package_state, commit_id, update_type FROM history_items '
+            'ORDER BY package_state, position'
+        )
+        assert cursor.fetchall() == [
+            (1, 'bbbb', 'security'), (1, 'aaaa', 'bugfix'),
+            (2, 'bbbb', 'security'), (2, 'aaaa', 'bugfix'),
+            (3, 'bbbb', 'security'), (3, 'aaaa', 'bugfix'),
+        ]
+
+
+def test_history_retention(tmp_path):
+    with HistoryStore(str(tmp_path / 'history.db')) as store:
+        store.record(make_result(datetime(2019, 2, 1), up_to_date=True))
+        store.record(make_result(datetime(2019, 2, 2), up_to_date=False))
+        store.record(make_result(datetime(2019, 2, 3), up_to_date=False))
+        store.record(make_result(datetime(2019, 2, 4), up_to_date=False),
+                     retention=timedelta(days=2))
+
+        states = store.query_flatpak('eog')
+        assert [(s.good, s.since.day, s.until.day) for s in states] == [
+            (False, 2, 4),
+        ]
+
+        cursor = store.connection.execute('SELECT MIN(id), COUNT(*) FROM generations')
+        assert cursor.fetchone() == (2, 3)
+
+        # The history items of the dropped package state went with it
+        cursor = store.connection.execute('SELECT DISTINCT package_state FROM history_items')
+        assert cursor.fetchall() == [(2,)]
+
+
+def test_history_no_source(tmp_path):
+    # Builds without a source in Koji have no commit
+    package = PackageResult(OLD_BUILD, None, 'f29', None, [
+        HistoryItem(None, OLD_BUILD, None, True),
+    ])
+    result = InvestigationResult(datetime(2019, 2, 1), [
+        FlatpakResult('eog', [FlatpakBuildResult(FLATPAK_BUILD, None, [package])]),
+    ])
+
+    with HistoryStore(str(tmp_path / 'history.db')) as store:
+        store.record(result)
+        store.record(InvestigationResult(datetime(2019, 2, 2), result.flatpaks))
+
+        cursor = store.connection.execute(
+            'SELECT commit_id, first_generation, last_generation FROM package_states'
+        )
+        assert cursor.fetchall() == [(None, 1, 2)]
+
+        cursor = store.connection.execute('SELECT commit_id, nvr FROM history_items')
+        assert cursor.fetchall() == [(None, 'eog-3.28.3-1.fc29')]
+
+
+def test_history_unchecked(tmp_path):
+    with HistoryStore(str(tmp_path / 'history.db')) as store:
+        store.record(InvestigationResult(datetime(2019, 2, 1), [
+            FlatpakResult('eog', [], stale=True),
+        ]))
+
+        eog, = store.query_flatpak('eog')
+        assert eog.good is None and eog.stale
+
+        # Not known to be out-of-date
+        assert store.query_out_of_date() == []
+
+
+def test_history_out_of_date_since(tmp_path):
+    bugfix = HistoryItem('cccc', make_build(4, 'eog-3.28.3-2.fc29'),
+                         make_update('FEDORA-2018-3', 'bugfix'), True)
+    security = HistoryItem('dddd', make_build(5, 'eog-3.28.3-3.fc29'),
+                           make_update('FEDORA-2018-4', 'security'), True)
+    old = HistoryItem('aaaa', OLD_BUILD, None, True)
+
+    def make_out_of_date(date_updated, history):
+        package = PackageResult(OLD_BUILD, None, 'f29', 'aaaa', history)
+        return InvestigationResult(date_updated, [
+            FlatpakResult('eog', [FlatpakBuildResult(FLATPAK_BUILD, None, [package])]),
+        ])
+
+    with HistoryStore(str(tmp_path / 'history.db')) as store:
+        store.record(make_result(datetime(2019, 1, 1), up_to_date=True))
+        store.record(make_out_of_date(datetime(2019, 1, 2), [bugfix, old]))
+        store.record(make_out_of_date(datetime(2019, 1, 5), [security, bugfix, old]))
+        store.record(make_out_of_date(datetime(2019, 1, 6), [security, bugfix, old]))
+
+        # Picking up a security update started a new state, but the Flatpak
+        # has been out-of-date since before that
+        assert [(s.has_security_updates, s.since.day)
+                for s in store.query_flatpak('eog')][1:] == [(False, 2), (True, 5)]
+        eog, = store.query_out_of_date()
+        assert eog.has_security_updates and eog.since.day == 2
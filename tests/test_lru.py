@@ -0,0 +1,42 @@
+from flatpak_status.lru import LRUCache
+
+
+def test_lru_cache():
+    cache = LRUCache(max_size=2)
+
+    cache['a'] = 1
+    cache['b'] = 2
+    assert len(cache) == 2
+
+    # Using 'a' makes 'b' the least recently used
+    assert cache.get('a') == 1
+    cache['c'] = 3
+
+    assert 'a' in cache
+    assert 'b' not in cache
+    assert cache.get('b') is None
+    assert cache.get('c') == 3
+    assert cache.evictions == 1
+    assert len(cache) == 2
+
+
+def test_lru_cache_setdefault():
+    cache = LRUCache(max_size=2)
+
+    s = cache.setdefault('a', set())
+    s.add(1)
+    assert cache.setdefault('a', set()) == {1}
+
+    cache.setdefault('b', None)
+    assert cache.setdefault('b', 42) is None
+
+
+def test_lru_cache_resize():
+    cache = LRUCache(max_size=3)
+    for key in 'abc':
+        cache[key] = key
+
+    cache.resize(1)
+    assert len(cache) == 1
+    assert 'c' in cache
+    assert cache.evictions == 2
@@ -0,0 +1,103 @@
+from unittest.mock import patch
+
+from flatpak_indexer.test.bodhi import mock_bodhi
+from flatpak_indexer.test.koji import mock_koji
+from flatpak_indexer.test.redis import mock_redis
+import pytest
+
+from flatpak_status.cli import Config
+from flatpak_status.modulemd import (
+    _get_rpm_refs_fast, _get_rpm_refs_libmodulemd, get_rpm_refs
+)
+from flatpak_status.update import Investigation, Session
+from .distgit_mock import make_mock_distgit
+
+
+CONFIG = """
+cache_dir: cache
+output: generated/status.json
+koji_config: fedora
+redis_url: redis://localhost:16379
+redis_password: abc123
+"""
+
+MODULEMD = """\
+---
+document: modulemd
+version: 2
+data:
+  name: eog
+  stream: master
+  version: 20181128204005
+  context: 775baa8e
+  summary: Eye of GNOME
+  components:
+    rpms:
+      eog:
+        rationale: Application package
+        ref: f29
+      exempi:
+        rationale: Runtime dependency
+        ref: 9b072f23540e45282678d9397faa8e28982fcbbd
+...
+"""
+
+
+def test_get_rpm_refs_fast():
+    assert _get_rpm_refs_fast(MODULEMD, 'eog', 'master') == {
+        'eog': 'f29',
+        'exempi': '9b072f23540e45282678d9397faa8e28982fcbbd',
+    }
+
+
+@pytest.mark.parametrize('modulemd', [
+    # Not YAML
+    "data: [",
+    # Not for this stream
+    MODULEMD.replace('stream: master', 'stream: f29'),
+    # A stream that YAML parses as a number
+    MODULEMD.replace('stream: master', 'stream: 3.28'),
+    # A ref that YAML parses as a number
+    MODULEMD.replace('ref: f29', 'ref: 1234'),
+    # An older document version
+    MODULEMD.replace('version: 2', 'version: 1', 1),
+    # More than one document
+    MODULEMD + MODULEMD,
+])
+def test_get_rpm_refs_unusual(modulemd):
+    assert _get_rpm_refs_fast(modulemd, 'eog', 'master') is None
+
+
+def test_get_rpm_refs_fallback():
+    with patch('flatpak_status.modulemd._Loader', None), \
+         patch('flatpak_status.modulemd._get_rpm_refs_libmodulemd',
+               return_value={'eog': 'f29'}) as get_rpm_refs_libmodulemd:
+        assert get_rpm_refs(MODULEMD, 'eog', 'master') == {'eog': 'f29'}
+
+    get_rpm_refs_libmodulemd.assert_called_once_with(MODULEMD, 'eog', 'master')
+
+
+@mock_bodhi
+@mock_koji
+@mock_redis
+def test_get_rpm_refs_matches_libmodulemd():
+    config = Config.from_str(CONFIG)
+    session = Session(config, make_mock_distgit())
+
+    investigation = Investigation()
+    investigation.investigate(session)
+
+    module_builds = {
+        pi.module_build.nvr: pi.module_build
+        for fi in investigation.flatpak_investigations
+        for bi in fi.build_investigations
+        for pi in bi.package_investigations
+        if pi.module_build is not None
+    }
+    assert len(module_builds) > 0
+
+    for module_build in module_builds.values():
+        name, stream = module_build.nvr.name, module_build.nvr.version
+        refs = _get_rpm_refs_fast(module_build.modulemd, name, stream)
+        assert refs is not None
+        assert refs == _get_rpm_refs_libmodulemd(module_build.modulemd, name, stream)
@@ -0,0 +1,98 @@
+import functools
+import random
+
+import pytest
+
+from flatpak_status.nvr import nvr_sort_key, set_sort_key_cache_size, sort_key_cache_info
+from .rpmvercmp import rpmvercmp
+
+
+# From rpm's tests/rpmvercmp.at
+@pytest.mark.parametrize('a,b,expected', [
+    ('1.0', '1.0', 0),
+    ('1.0', '2.0', -1),
+    ('2.0.1', '2.0.1', 0),
+    ('2.0', '2.0.1', -1),
+    ('2.0.1a', '2.0.1', 1),
+    ('5.5p1', '5.5p2', -1),
+    ('5.5p10', '5.5p1', 1),
+    ('10xyz', '10.1xyz', -1),
+    ('xyz10', 'xyz10.1', -1),
+    ('xyz.4', '8', -1),
+    ('5.5p1', '5.6p1', -1),
+    ('6.0.rc1', '6.0', 1),
+    ('10b2', '10a1', 1),
+    ('1.0aa', '1.0a', 1),
+    ('10.0001', '10.1', 0),
+    ('10.0039', '10.39', 0),
+    ('4.999.9', '5.0', -1),
+    ('20101121', '20101122', -1),
+    ('2_0', '2_0', 0),
+    ('2.0', '2_0', 0),
+    ('a', 'a', 0),
+    ('a+', 'a_', 0),
+    ('+a', '_a', 0),
+    ('+', '_', 0),
+    ('1.0~rc1', '1.0~rc1', 0),
+    ('1.0~rc1', '1.0', -1),
+    ('1.0~rc1', '1.0~rc2', -1),
+    ('1.0~rc1~git123', '1.0~rc1', -1),
+    ('1.0^', '1.0', 1),
+    ('1.0^git1', '1.0', 1),
+    ('1.0^git1', '1.0^git2', -1),
+    ('1.0^git1', '1.01', -1),
+    ('1.0^20160101', '1.0.1', -1),
+    ('1.0^20160101^git1', '1.0^20160101', 1),
+    ('1.0~rc1^git1', '1.0~rc1', 1),
+    ('1.0^git1~pre', '1.0^git1', -1),
+])
+def test_rpmvercmp(a, b, expected):
+    assert rpmvercmp(a, b) == expected
+    assert rpmvercmp(b, a) == -expected
+
+    key_a = nvr_sort_key(f'foo-{a}-1')
+    key_b = nvr_sort_key(f'foo-{b}-1')
+    assert (key_a > key_b) - (key_a < key_b) == expected
+
+
+def test_nvr_sort_key_random():
+    rng = random.Random(42)
+    parts = ['0', '1', '01', '2', '10', 'a', 'b', 'rc', '.', '_', '~', '^', '+']
+    versions = {''.join(rng.choice(parts) for _ in range(rng.randint(1, 6)))
+                for _ in range(500)}
+
+    expected = sorted(versions, key=functools.cmp_to_key(rpmvercmp))
+    result = sorted(versions, key=lambda v: nvr_sort_key(f'foo-{v}-1'))
+
+    for a, b in zip(expected, result):
+        assert rpmvercmp(a, b) == 0
+
+
+def test_nvr_sort_key():
+    nvrs = [
+        'eog-3.28.4-1.fc29',
+        'eog-3.28.4-10.fc29',
+        'eog-3.28.4-2.fc29',
+        'eog-1:3.0-1.fc29',
+        'eog-3.28.10-1.fc29',
+    ]
+    assert sorted(nvrs, key=nvr_sort_key) == [
+        'eog-3.28.4-1.fc29',
+        'eog-3.28.4-2.fc29',
+        'eog-3.28.4-10.fc29',
+        'eog-3.28.10-1.fc29',
+        'eog-1:3.0-1.fc29',
+    ]
+
+    # Memoized
+    assert nvr_sort_key('eog-3.28.4-1.fc29') is nvr_sort_key('eog-3.28.4-1.fc29')
+
+
+def test_nvr_sort_key_cache_size():
+    try:
+        set_sort_key_cache_size(2)
+        sorted(['eog-3.28.4-1.fc29', 'eog-3.28.3-1.fc29', 'eog-3.30.0-1.fc30'], key=nvr_sort_key)
+        info = sort_key_cache_info()
+        assert (info.currsize, info.misses) == (2, 3)
+    finally:
+        set_sort_key_cache_size(100000)
@@ -0,0 +1,49 @@
+from flatpak_indexer.test.redis import mock_redis
+
+from flatpak_status.cli import Config
+from flatpak_status.package_index import (
+    query_affected_flatpaks, query_package_flatpak_builds, update_package_index
+)
+from flatpak_status.update import Session
+from .distgit_mock import make_mock_distgit
+
+
+CONFIG = """
+cache_dir: cache
+output: generated/status.json
+koji_config: fedora
+redis_url: redis://localhost:16379
+redis_password: abc123
+"""
+
+
+@mock_redis
+def test_package_index():
+    session = Session(Config.from_str(CONFIG), make_mock_distgit())
+    redis_client = session.redis_client
+
+    assert query_package_flatpak_builds(redis_client, 'exempi') == []
+    assert query_affected_flatpaks(redis_client, ['exempi']) == set()
+
+    update_package_index(redis_client, {
+        'eog-master-20181128204005.1': {'eog', 'exempi', 'libpeas'},
+        'eog-master-20181105164812.1': {'eog', 'exempi'},
+        'totem-stable-3220190127195734.1': {'totem', 'libpeas'},
+    })
+
+    assert query_package_flatpak_builds(redis_client, 'exempi') == [
+        'eog-master-20181105164812.1', 'eog-master-20181128204005.1'
+    ]
+    assert query_affected_flatpaks(redis_client, ['exempi']) == {'eog'}
+    assert query_affected_flatpaks(redis_client, ['libpeas', 'NOTEXIST']) == {'eog', 'totem'}
+    assert query_affected_flatpaks(redis_client, []) == set()
+
+    # The index is replaced, not merged into
+    update_package_index(redis_client, {
+        'totem-stable-3220190127195734.1': {'totem', 'libpeas'},
+    })
+    assert query_package_flatpak_builds(redis_client, 'exempi') == []
+    assert query_affected_flatpaks(redis_client, ['libpeas']) == {'totem'}
+
+    update_package_index(redis_client, {})
+    assert query_affected_flatpaks(redis_client, ['libpeas']) == set()
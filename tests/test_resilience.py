@@ -0,0 +1,52 @@
+import asyncio
+
+import pytest
+
+from flatpak_status.resilience import CircuitBreaker, CircuitOpenError, retry_async
+
+
+def test_circuit_breaker():
+    breaker = CircuitBreaker(2)
+
+    breaker.record_failure('rpms/eog')
+    breaker.check('rpms/eog')
+
+    # Failures have to be consecutive
+    breaker.record_success('rpms/eog')
+    breaker.record_failure('rpms/eog')
+    assert breaker.is_healthy('rpms/eog')
+
+    breaker.record_failure('rpms/eog')
+    assert not breaker.is_healthy('rpms/eog')
+    with pytest.raises(CircuitOpenError, match='rpms/eog is marked unhealthy'):
+        breaker.check('rpms/eog')
+
+    breaker.trip('koji')
+    assert not breaker.is_healthy('koji')
+    assert breaker.is_healthy('bodhi')
+
+    assert CircuitBreaker(2, unhealthy={'koji'}).unhealthy == {'koji'}
+
+
+def test_retry_async(caplog):
+    calls = 0
+
+    async def flaky(failures):
+        nonlocal calls
+        calls += 1
+        if calls <= failures:
+            raise RuntimeError(f"Failure {calls}")
+        return calls
+
+    assert asyncio.run(retry_async(lambda: flaky(2), attempts=3, delay=0)) == 3
+    assert caplog.text.count('retrying in') == 2
+
+    calls = 0
+    with pytest.raises(RuntimeError, match='Failure 2'):
+        asyncio.run(retry_async(lambda: flaky(2), attempts=2, delay=0))
+
+    # Only the listed exceptions are retried
+    calls = 0
+    with pytest.raises(RuntimeError, match='Failure 1'):
+        asyncio.run(retry_async(lambda: flaky(2), attempts=3, delay=0, exceptions=(OSError,)))
+    assert calls == 1
@@ -0,0 +1,248 @@
+from datetime import datetime
+import json
+import os
+import pickle
+from types import SimpleNamespace
+from unittest.mock import patch
+
+import pytest
+
+import flatpak_status.results
+from flatpak_status.results import (
+    BuildSummary, encode_json, FlatpakBuildResult, FlatpakResult, HistoryItem,
+    InvestigationResult, PackageResult, UpdateSummary
+)
+from flatpak_status.update import UpdateJsonEncoder
+
+
+class NVR(str):
+    pass
+
+
+def make_result():
+    build = BuildSummary.from_model(SimpleNamespace(
+        build_id=1063042, nvr=NVR('eog-3.28.4-1.fc29'), user_name='kalev',
+        completion_time=datetime(2018, 9, 4, 9, 37, 19)
+    ))
+    update = UpdateSummary.from_model(SimpleNamespace(
+        update_id='FEDORA-2018-ac69655fa3', status='stable', type='bugfix',
+        user_name='kalev', date_submitted=datetime(2018, 9, 4, 10, 0, 0)
+    ))
+    flatpak_build = BuildSummary.from_model(SimpleNamespace(
+        build_id=1164214, nvr=NVR('eog-master-20181128204005.1'), user_name='otaylor',
+        completion_time=datetime(2018, 11, 28, 20, 55, 8)
+    ))
+
+    commit = '9b072f23540e45282678d9397faa8e28982fcbbd'
+    # A separate string object with the same contents
+    history_commit = commit[:20] + commit[20:]
+    package = PackageResult(build, None, 'f29', commit,
+                            [HistoryItem(history_commit, build, update, True)])
+
+    return InvestigationResult(
+        datetime(2019, 2, 6, 0, 0, 0),
+        [FlatpakResult('eog', [FlatpakBuildResult(flatpak_build, None, [package])])]
+    )
+
+
+def test_result_json():
+    data = json.loads(json.dumps(make_result(), cls=UpdateJsonEncoder))
+
+    assert data == {
+        'date_updated': '2019-02-06T00:00:00Z',
+        'flatpaks': [{
+            'name': 'eog',
+            'builds': [{
+                'build': {
+                    'id': 1164214,
+                    'nvr': 'eog-master-20181128204005.1',
+                    'user_name': 'otaylor',
+                    'completion_time': '2018-11-28T20:55:08Z',
+                },
+                'packages': [{
+                    'build': {'id': 1063042, 'nvr': 'eog-3.28.4-1.fc29'},
+                    'branch': 'f29',
+                    'commit': '9b072f23540e45282678d9397faa8e28982fcbbd',
+                    'history': [{
+                        'commit': '9b072f23540e45282678d9397faa8e28982fcbbd',
+                        'build': {'id': 1063042, 'nvr': 'eog-3.28.4-1.fc29'},
+                        'update': {
+                            'id': 'FEDORA-2018-ac69655fa3',
+                            'status': 'stable',
+                            'type': 'bugfix',
+                        },
+                    }],
+                    'good': True,
+                }],
+                'good': True,
+                'has_security_updates': False,
+                'out_of_date_packages': [],
+            }],
+            'good': True,
+            'has_security_updates': False,
+        }],
+    }
+
+
+def load_verdict_cases():
+    with open(os.path.join(os.path.dirname(__file__), 'verdicts.json')) as f:
+        return json.load(f)
+
+
+def _build_from_json(data):
+    return BuildSummary(data['id'], data['nvr'], None, None)
+
+
+def _update_from_json(data):
+    if data is None:
+        return None
+    return UpdateSummary(data['id'], data['status'], data['type'], None, None)
+
+
+@pytest.mark.parametrize('case', load_verdict_cases(), ids=lambda case: case['description'])
+def test_result_verdicts(case):
+    # The same cases are checked against web/verdicts.js by tests/test-verdicts.js
+    packages = [
+        PackageResult(_build_from_json(p['build']), None, p['branch'], p['commit'], [
+            HistoryItem(item['commit'], _build_from_json(item['build']),
+                        _update_from_json(item.get('update')), False)
+            for item in p['history']
+        ])
+        for p in case['build']['packages']
+    ]
+    flatpak_build = BuildSummary(1, 'eog-master-1.1', 'otaylor', datetime(2019, 1, 1, 0, 0, 0))
+    build = FlatpakBuildResult(flatpak_build, None, packages)
+    data = build.to_json()
+    expected = case['expected']
+
+    assert [p['good'] for p in data['packages']] == expected['package_good']
+    assert data['good'] == expected['good']
+    assert data['has_security_updates'] == expected['has_security_updates']
+    assert data['out_of_date_packages'] == expected['out_of_date_packages']
+
+    flatpak_data = FlatpakResult('eog', [build]).to_json()
+    assert flatpak_data['good'] == expected['good']
+    assert flatpak_data['has_security_updates'] == expected['has_security_updates']
+
+
+def test_result_compact():
+    result = make_result()
+
+    package = result.flatpaks[0].builds[0].packages[0]
+    assert not hasattr(package, '__dict__')
+    assert not hasattr(package.history[0], '__dict__')
+
+    # NVRs are stored as interned plain strings
+    assert type(package.build.nvr) is str
+    assert package.commit is package.history[0].commit
+
+
+def test_summaries_shared():
+    def make_build():
+        return SimpleNamespace(build_id=1063043, nvr=NVR('eog-3.28.4-2.fc29'), user_name='kalev',
+                               completion_time=datetime(2018, 9, 5, 9, 37, 19))
+
+    def make_update(status):
+        return SimpleNamespace(update_id='FEDORA-2018-0123456789', status=status,
+                               type='security', user_name='kalev',
+                               date_submitted=datetime(2018, 9, 5, 10, 0, 0))
+
+    build = BuildSummary.from_model(make_build())
+    assert BuildSummary.from_model(make_build()) is build
+    assert build.to_json(include_details=True) is build.to_json(include_details=True)
+    assert build.to_json() == {'id': 1063043, 'nvr': 'eog-3.28.4-2.fc29'}
+
+    update = UpdateSummary.from_model(make_update('testing'))
+    assert UpdateSummary.from_model(make_update('testing')) is update
+    assert update.to_json() is update.to_json()
+
+    stable_update = UpdateSummary.from_model(make_update('stable'))
+    assert stable_update is not update
+    assert stable_update.to_json()['status'] == 'stable'
+
+
+def test_result_pickle():
+    result = make_result()
+    result2 = pickle.loads(pickle.dumps(result))
+
+    assert (json.dumps(result, cls=UpdateJsonEncoder) ==
+            json.dumps(result2, cls=UpdateJsonEncoder))
+
+    # Builds shared within the result are still shared
+    package = result2.flatpaks[0].builds[0].packages[0]
+    assert package.build is package.history[0].build
+
+
+def test_result_merge_into():
+    previous = make_result()
+    previous = InvestigationResult(previous.date_updated, [
+        FlatpakResult('aisleriot', []),
+        previous.flatpaks[0],
+        FlatpakResult('totem', []),
+    ])
+
+    eog = FlatpakResult('eog', [])
+    partial = InvestigationResult(datetime(2019, 2, 7, 0, 0, 0),
+                                  [eog, FlatpakResult('baobab', [])])
+
+    merged = partial.merge_into(previous)
+    assert merged.date_updated == previous.date_updated
+    assert [f.name for f in merged.flatpaks] == ['aisleriot', 'baobab', 'eog', 'totem']
+    assert merged.flatpaks[2] is eog
+
+
+def test_result_catch_up():
+    result = make_result()
+    assert result.list_packages() == {'eog'}
+    # The only update is stable already
+    assert result.list_unsettled_updates() == set()
+
+    testing = UpdateSummary.from_model(SimpleNamespace(
+        update_id='FEDORA-2018-1a0cf961a1', status='testing', type='bugfix',
+        user_name='otaylor', date_submitted=datetime(2018, 11, 28, 21, 0, 0)
+    ))
+    build = result.flatpaks[0].builds[0]
+    result = InvestigationResult(result.date_updated, [
+        FlatpakResult('eog', [FlatpakBuildResult(build.build, testing, build.packages)]),
+    ])
+    assert result.list_unsettled_updates() == {'FEDORA-2018-1a0cf961a1'}
+
+
+def test_result_stale():
+    previous = make_result()
+    result = InvestigationResult(datetime(2019, 2, 7, 0, 0, 0), [
+        FlatpakResult('eog', [], stale=True),
+        FlatpakResult('totem', [], stale=True),
+    ])
+
+    filled = result.fill_stale(previous)
+    assert filled.date_updated == result.date_updated
+
+    eog, totem = filled.flatpaks
+    assert eog.stale and eog.builds == previous.flatpaks[0].builds
+    assert totem.stale and totem.builds == ()
+
+    # With no previous builds, the Flatpak wasn't checked at all
+    assert eog.is_good() is True
+    assert totem.is_good() is None
+
+    data = filled.to_json()
+    assert data['flatpaks'][0]['stale'] is True
+    assert data['flatpaks'][1]['good'] is None
+    assert 'stale' not in previous.to_json()['flatpaks'][0]
+
+
+@pytest.mark.parametrize('use_orjson', [False, True])
+def test_encode_json(use_orjson):
+    if use_orjson:
+        pytest.importorskip('orjson')
+        encoder = flatpak_status.results.orjson
+    else:
+        encoder = None
+
+    result = make_result()
+    with patch('flatpak_status.results.orjson', encoder):
+        encoded = encode_json(result.to_json())
+
+    assert isinstance(encoded, bytes)
+    assert json.loads(encoded) == json.loads(json.dumps(result, cls=UpdateJsonEncoder, indent=4))
@@ -0,0 +1,180 @@
+from datetime import datetime
+import http.client
+import json
+import time
+
+import pytest
+
+from flatpak_status.results import FlatpakResult, InvestigationResult
+from flatpak_status.server import EventBroadcaster, ResultIndex, StatusServer
+from .test_results import make_result
+
+
+def parse_events(events):
+    result = []
+    for event in events:
+        lines = event.decode('UTF-8').strip().split('\n')
+        assert lines[0].startswith('event: ')
+        assert lines[1].startswith('data: ')
+        result.append((lines[0][7:], json.loads(lines[1][6:])))
+
+    return result
+
+
+def test_event_broadcaster():
+    broadcaster = EventBroadcaster(max_queued=2)
+    subscription = broadcaster.subscribe()
+
+    result = make_result()
+    broadcaster.publish(result)
+    events = parse_events(subscription.queue.get_nowait())
+    assert events == [
+        ('flatpak', result.flatpaks[0].to_json()),
+        ('updated', {'date_updated': '2019-02-06T00:00:00Z'}),
+    ]
+
+    # Only changes are sent
+    result2 = InvestigationResult(datetime(2019, 2, 7, 0, 0, 0),
+                                  [FlatpakResult('aisleriot', []), result.flatpaks[0]])
+    broadcaster.publish(result2)
+    events = parse_events(subscription.queue.get_nowait())
+    assert [event for event, _ in events] == ['flatpak', 'updated']
+    assert events[0][1]['name'] == 'aisleriot'
+
+    broadcaster.publish(InvestigationResult(datetime(2019, 2, 8, 0, 0, 0), []))
+    events = parse_events(subscription.queue.get_nowait())
+    assert events == [
+        ('removed', {'name': 'aisleriot'}),
+        ('removed', {'name': 'eog'}),
+        ('updated', {'date_updated': '2019-02-08T00:00:00Z'}),
+    ]
+
+    # A subscriber that falls behind is dropped
+    for i in range(3):
+        broadcaster.publish(result)
+    assert subscription.closed
+    assert subscription not in broadcaster.subscriptions
+
+
+def test_result_index():
+    result = make_result()
+    result = InvestigationResult(result.date_updated, [
+        FlatpakResult('aisleriot', [], stale=True), result.flatpaks[0]
+    ])
+    index = ResultIndex(result)
+
+    assert index.query('/status', {}) == {
+        'date_updated': '2019-02-06T00:00:00Z',
+        'flatpaks': 2,
+        'statuses': {'good': 1, 'out-of-date': 0, 'security': 0, 'stale': 1},
+    }
+
+    def names(params):
+        return [f['name'] for f in index.query('/flatpaks', params)['flatpaks']]
+
+    assert names({}) == ['aisleriot', 'eog']
+    assert names({'status': 'stale'}) == ['aisleriot']
+    # aisleriot wasn't checked, so is neither good nor out-of-date
+    assert names({'status': 'good'}) == ['eog']
+    assert names({'status': 'out-of-date'}) == []
+    assert names({'package': 'eog'}) == ['eog']
+    assert names({'package': 'eog', 'status': 'stale'}) == []
+    assert names({'update': 'FEDORA-2018-ac69655fa3'}) == ['eog']
+    assert names({'update': 'NOTEXIST'}) == []
+    with pytest.raises(ValueError, match="Unknown status 'bad'"):
+        index.query('/flatpaks', {'status': 'bad'})
+
+    assert index.query('/flatpaks/eog', {})['flatpak'] == result.flatpaks[1].to_json()
+    assert index.query('/flatpaks/NOTEXIST', {}) is None
+
+    data = index.query('/packages/eog', {})
+    assert [(b['flatpak'], b['build']['nvr'], b['package']['commit']) for b in data['builds']] == [
+        ('eog', 'eog-master-20181128204005.1', '9b072f23540e45282678d9397faa8e28982fcbbd'),
+    ]
+    assert index.query('/packages/NOTEXIST', {}) is None
+
+    data = index.query('/updates/FEDORA-2018-ac69655fa3', {})
+    assert data['flatpaks'] == [
+        {'name': 'eog', 'good': True, 'has_security_updates': False, 'stale': False},
+    ]
+
+    assert index.query('/nothing', {}) is None
+
+
+@pytest.fixture
+def server():
+    server = StatusServer('localhost', 0)
+    server.start()
+    try:
+        yield server
+    finally:
+        server.stop()
+
+
+def test_status_server_events(server):
+    connection = http.client.HTTPConnection('localhost', server.port, timeout=10)
+    connection.request('GET', '/events')
+    response = connection.getresponse()
+    assert response.status == 200
+    assert response.getheader('Content-Type') == 'text/event-stream'
+
+    # Wait until the handler has subscribed
+    while len(server.broadcaster.subscriptions) == 0:
+        time.sleep(0.01)
+
+    server.publish(make_result())
+
+    assert response.readline() == b'event: flatpak\n'
+    assert json.loads(response.readline()[len('data: '):])['name'] == 'eog'
+    assert response.readline() == b'\n'
+    assert response.readline() == b'event: updated\n'
+
+    connection.close()
+
+
+def test_status_server_not_found(server):
+    connection = http.client.HTTPConnection('localhost', server.port, timeout=10)
+    connection.request('GET', '/nothing')
+    assert connection.getresponse().status == 404
+    connection.close()
+
+
+def test_status_server_api(server):
+    connection = http.client.HTTPConnection('localhost', server.port, timeout=10)
+
+    connection.request('GET', '/api/flatpaks')
+    response = connection.getresponse()
+    response.read()
+    assert response.status == 503
+
+    server.publish(make_result())
+
+    connection.request('GET', '/api/flatpaks?status=good')
+    response = connection.getresponse()
+    assert response.status == 200
+    assert response.getheader('Content-Type') == 'application/json'
+    assert [f['name'] for f in json.loads(response.read())['flatpaks']] == ['eog']
+    etag = response.getheader('ETag')
+
+    connection.request('GET', '/api/flatpaks?status=good', headers={'If-None-Match': etag})
+    response = connection.getresponse()
+    response.read()
+    assert response.status == 304
+
+    connection.request('GET', '/api/flatpaks?status=out-of-date',
+                       headers={'If-None-Match': etag})
+    response = connection.getresponse()
+    assert response.status == 200
+    assert json.loads(response.read())['flatpaks'] == []
+
+    connection.request('GET', '/api/flatpaks?status=bad')
+    response = connection.getresponse()
+    response.read()
+    assert response.status == 400
+
+    connection.request('GET', '/api/flatpaks/NOTEXIST')
+    response = connection.getresponse()
+    response.read()
+    assert response.status == 404
+
+    connection.close()
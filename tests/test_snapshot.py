@@ -0,0 +1,38 @@
+import json
+import pickle
+
+import pytest
+
+from flatpak_status.results import encode_json
+from flatpak_status.snapshot import load_snapshot, save_snapshot, SnapshotError
+from .test_results import make_result
+
+
+def test_snapshot(tmp_path):
+    path = str(tmp_path / 'investigation.pickle')
+
+    with pytest.raises(SnapshotError, match='No snapshot'):
+        load_snapshot(path)
+
+    result = make_result()
+    save_snapshot(path, result)
+
+    loaded = load_snapshot(path)
+    assert loaded.date_updated == result.date_updated
+    assert json.loads(encode_json(loaded.to_json())) == json.loads(encode_json(result.to_json()))
+
+
+def test_snapshot_bad(tmp_path):
+    path = str(tmp_path / 'investigation.pickle')
+
+    with open(path, 'wb') as f:
+        pickle.dump((0, None), f)
+
+    with pytest.raises(SnapshotError, match='Snapshot version 0'):
+        load_snapshot(path)
+
+    with open(path, 'wb') as f:
+        f.write(b'GARBAGE')
+
+    with pytest.raises(SnapshotError, match="Can't load snapshot"):
+        load_snapshot(path)
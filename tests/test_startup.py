@@ -0,0 +1,42 @@
+import os
+import subprocess
+import sys
+
+# Modules that importing the command line must not pull in - they are
+# imported by the commands that need them
+DEFERRED_MODULES = {
+    'gi',
+    'flatpak_indexer.bodhi_query',
+    'flatpak_indexer.fedora_monitor',
+    'flatpak_status.update',
+}
+
+# Budget for the cumulative time to import flatpak_status.cli, in seconds.
+# This is generous, since test machines vary, but catches a slow import
+# creeping back in.
+IMPORT_TIME_BUDGET = 1.5
+
+
+def import_times(module):
+    # Returns module name => cumulative import time in microseconds
+    result = subprocess.run(
+        [sys.executable, '-X', 'importtime', '-c', f'import {module}'],
+        cwd=os.path.dirname(os.path.dirname(os.path.abspath(__file__))),
+        stderr=subprocess.PIPE, check=True, encoding='UTF-8'
+    )
+
+    times = {}
+    for line in result.stderr.splitlines():
+        if not line.startswith('import time:') or 'cumulative' in line:
+            continue
+        _, cumulative, name = line[len('import time:'):].split('|')
+        times[name.strip()] = int(cumulative)
+
+    return times
+
+
+def test_cli_import_time():
+    times = import_times('flatpak_status.cli')
+
+    assert DEFERRED_MODULES & times.keys() == set()
+    assert times['flatpak_status.cli'] / 1e6 < IMPORT_TIME_BUDGET
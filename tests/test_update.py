@@ -1,12 +1,24 @@
+import asyncio
+from datetime import timedelta
 import json
+import os
+import threading
+from types import SimpleNamespace
+from unittest.mock import patch
 
 from flatpak_indexer.test.bodhi import mock_bodhi
 from flatpak_indexer.test.koji import mock_koji
 from flatpak_indexer.test.redis import mock_redis
 
 from flatpak_status.cli import Config
-from flatpak_status.update import Investigation, Session, UpdateJsonEncoder
-from .distgit_mock import make_mock_distgit
+from flatpak_status.distgit import GitError
+from flatpak_status.resilience import CircuitBreaker
+from flatpak_status.results import encode_json
+from flatpak_status.update import (
+    _make_shards, FlatpakInvestigation, Investigation, refresh_update_statuses, Refresher, Session,
+    UpdateJsonEncoder
+)
+from .distgit_mock import make_mock_distgit, MockDistGitRepo
 
 
 CONFIG = """
@@ -86,6 +98,10 @@ def test_flatpak_investigation():
     as_json = json.dumps(investigation, cls=UpdateJsonEncoder, indent=4)
     data = json.loads(as_json)
 
+    result_data = json.loads(encode_json(investigation.result().to_json()))
+    del result_data['date_updated']
+    assert result_data == {k: v for k, v in data.items() if k != 'date_updated'}
+
     feedreader_data = next(x for x in data['flatpaks'] if x['name'] == 'feedreader')
 
     assert feedreader_data['name'] == 'feedreader'
@@ -111,3 +127,211 @@ def test_flatpak_investigation():
     del d2['date_updated']
 
     assert d1 == d2
+
+
+@mock_bodhi
+@mock_koji
+@mock_redis
+def test_flatpak_investigation_jobs():
+    config = Config.from_str(CONFIG)
+
+    investigation = Investigation()
+    investigation.investigate(Session(config, make_mock_distgit()))
+
+    sharded_investigation = Investigation()
+    sharded_investigation.investigate(Session(config, make_mock_distgit()), jobs=3)
+
+    d1 = json.loads(json.dumps(investigation, cls=UpdateJsonEncoder))
+    d2 = json.loads(json.dumps(sharded_investigation, cls=UpdateJsonEncoder))
+    del d1['date_updated']
+    del d2['date_updated']
+
+    assert d1 == d2
+
+
+@mock_bodhi
+@mock_koji
+@mock_redis
+def test_flatpak_investigation_jobs_fetch():
+    config = Config.from_str(CONFIG)
+    parent_pid = os.getpid()
+
+    get_branches_async = MockDistGitRepo.get_branches_async
+
+    async def mock_get_branches_async(self, commit, try_mirroring=False):
+        if os.getpid() != parent_pid:
+            # Workers never fetch; pretend a commit needs fetching
+            assert not try_mirroring
+            if self.pkg == 'rpms/exempi':
+                raise GitError(f"rpms/exempi: {commit} is not in the mirror")
+        return await get_branches_async(self, commit, try_mirroring=try_mirroring)
+
+    investigation = Investigation()
+    investigation.investigate(Session(config, make_mock_distgit()))
+
+    with patch.object(MockDistGitRepo, 'get_branches_async', mock_get_branches_async):
+        sharded_investigation = Investigation()
+        sharded_investigation.investigate(Session(config, make_mock_distgit()), jobs=3)
+
+    # The Flatpaks with exempi were investigated again in the main process
+    d1 = json.loads(json.dumps(investigation, cls=UpdateJsonEncoder))
+    d2 = json.loads(json.dumps(sharded_investigation, cls=UpdateJsonEncoder))
+    del d1['date_updated']
+    del d2['date_updated']
+
+    assert d1 == d2
+
+
+def test_make_shards():
+    flatpak_packages = {
+        'eog': {'eog', 'exempi', 'libpeas'},
+        'gedit': {'gedit', 'libpeas'},
+        'totem': {'totem', 'gstreamer1'},
+        'cheese': {'cheese', 'gstreamer1'},
+    }
+    shards = _make_shards(sorted(flatpak_packages), flatpak_packages, 2)
+    assert sorted(sorted(shard) for shard in shards) == [['cheese', 'totem'], ['eog', 'gedit']]
+
+    # Shards are kept balanced, even when everything is related
+    shards = _make_shards(['a', 'b', 'c'], {name: {'glib2'} for name in 'abc'}, 2)
+    assert sorted(len(shard) for shard in shards) == [1, 2]
+
+
+@mock_bodhi
+@mock_koji
+@mock_redis
+def test_flatpak_investigation_partial_result():
+    config = Config.from_str(CONFIG)
+
+    partial_results = []
+    investigation = Investigation()
+    with patch.object(Investigation, '_find_security_flatpaks', return_value={'eog'}):
+        investigation.investigate(Session(config, make_mock_distgit()),
+                                  on_partial_result=partial_results.append)
+
+    assert len(partial_results) == 1
+    assert [f.name for f in partial_results[0].flatpaks] == ['eog']
+
+    eog_json = next(f for f in investigation.result().to_json()['flatpaks'] if f['name'] == 'eog')
+    assert partial_results[0].flatpaks[0].to_json() == eog_json
+
+    # Without security updates, nothing is published early
+    partial_results = []
+    with patch.object(Investigation, '_find_security_flatpaks', return_value=set()):
+        Investigation().investigate(Session(config, make_mock_distgit()),
+                                    on_partial_result=partial_results.append)
+
+    assert partial_results == []
+
+
+@mock_redis
+def test_refresher(caplog):
+    config = Config.from_str(CONFIG)
+    config.refresh_jobs = 2
+    config.refresh_timeout = timedelta(seconds=5)
+
+    # Both refreshes have to be running at once to get past the barrier
+    barrier = threading.Barrier(2)
+    calls = []
+
+    def refresh_something(session, arg):
+        barrier.wait()
+        calls.append(arg)
+
+    async def run():
+        refresher = Refresher(config, CircuitBreaker(config.failure_threshold))
+        await asyncio.gather(refresher.refresh(refresh_something, 'a'),
+                             refresher.refresh(refresh_something, 'b'))
+
+    asyncio.run(run())
+    assert sorted(calls) == ['a', 'b']
+
+    # A refresh that hangs is abandoned
+    config.refresh_timeout = timedelta(seconds=0.1)
+    hang = threading.Event()
+
+    def refresh_hang(session):
+        hang.wait()
+
+    async def run_hang():
+        refresher = Refresher(config, CircuitBreaker(config.failure_threshold))
+        await refresher.refresh(refresh_hang)
+
+    asyncio.run(run_hang())
+    assert 'refresh_hang timed out' in caplog.text
+
+    # ... and doesn't keep the process from exiting
+    thread, = [t for t in threading.enumerate() if t.name == 'refresh-refresh_hang']
+    assert thread.daemon
+    hang.set()
+    thread.join()
+
+
+def test_refresh_update_statuses(caplog):
+    config = Config.from_str(CONFIG)
+    session = SimpleNamespace(config=config, redis_client=object(),
+                              breaker=CircuitBreaker(config.failure_threshold))
+    calls = []
+
+    def refresh_update_status(indexer_session, update_id):
+        assert indexer_session.redis_client is session.redis_client
+        calls.append(update_id)
+        if update_id == 'FEDORA-2':
+            raise RuntimeError("Bodhi is down")
+
+    with patch('flatpak_status.update.refresh_update_status', refresh_update_status):
+        refresh_update_statuses(session, {'FEDORA-2', 'FEDORA-1', 'FEDORA-3'})
+
+    assert 'FEDORA-1' in calls and 'FEDORA-2' in calls
+    # The cached statuses are used instead
+    assert 'refresh_update_status failed, using cached information' in caplog.text
+
+
+@mock_bodhi
+@mock_koji
+@mock_redis
+def test_flatpak_investigation_stale():
+    config = Config.from_str(CONFIG)
+
+    get_branches_async = MockDistGitRepo.get_branches_async
+
+    async def mock_get_branches_async(self, commit, try_mirroring=False):
+        if self.pkg == 'rpms/exempi':
+            raise GitError("rpms/exempi: fetch timed out")
+        return await get_branches_async(self, commit, try_mirroring=try_mirroring)
+
+    session = Session(config, make_mock_distgit())
+    investigation = Investigation()
+    with patch.object(MockDistGitRepo, 'get_branches_async', mock_get_branches_async):
+        investigation.investigate(session)
+
+    flatpaks = {f['name']: f for f in investigation.result().to_json()['flatpaks']}
+    assert flatpaks['eog'] == {
+        'name': 'eog', 'builds': [], 'good': None, 'has_security_updates': False,
+        'stale': True,
+    }
+    assert not any(f.get('stale') for name, f in flatpaks.items()
+                   if 'exempi' not in investigation.flatpak_packages[name])
+
+
+def test_flatpak_investigation_add_builds():
+    def make_build(nvr):
+        return SimpleNamespace(nvr=nvr)
+
+    testing = SimpleNamespace(update_id='FEDORA-FLATPAK-2018-1', status='testing')
+    stable = SimpleNamespace(update_id='FEDORA-FLATPAK-2018-2', status='stable')
+
+    investigation = FlatpakInvestigation('eog')
+    investigation._add_build_investigation(make_build('eog-master-20181105164812.1'), testing)
+    investigation._add_build_investigation(make_build('eog-master-20181128204005.1'))
+    investigation._add_build_investigation(make_build('eog-master-20190101000000.1'), stable)
+    # The first update for a build wins, unless it was None
+    investigation._add_build_investigation(make_build('eog-master-20181105164812.1'), stable)
+    investigation._add_build_investigation(make_build('eog-master-20181128204005.1'), stable)
+    investigation._sort_build_investigations()
+
+    assert [(bi.build.nvr, bi.update) for bi in investigation.build_investigations] == [
+        ('eog-master-20190101000000.1', stable),
+        ('eog-master-20181128204005.1', stable),
+        ('eog-master-20181105164812.1', testing),
+    ]
@@ -0,0 +1,63 @@
+#!/usr/bin/python3
+
+# Compares sorting NVRs with a pairwise rpm version comparison, as is done
+# when sorting NVR objects directly, to sorting with nvr_sort_key().
+
+import functools
+import os
+import random
+import sys
+import timeit
+
+import click
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+
+from flatpak_status.nvr import nvr_sort_key, set_sort_key_cache_size  # noqa: E402
+# The direct port of rpm's version comparison lives with the tests
+from tests.rpmvercmp import rpmvercmp  # noqa: E402
+
+
+def compare_nvrs(a, b):
+    a_name, a_version, a_release = a.rsplit('-', 2)
+    b_name, b_version, b_release = b.rsplit('-', 2)
+    if a_name != b_name:
+        return -1 if a_name < b_name else 1
+
+    return rpmvercmp(a_version, b_version) or rpmvercmp(a_release, b_release)
+
+
+def make_nvrs(count, rng):
+    # Roughly like the builds in a release tag: many packages, each with a
+    # few builds.
+    nvrs = []
+    for i in range(count):
+        name = f'package{i // 4}'
+        version = '.'.join(str(rng.randint(0, 20)) for _ in range(rng.randint(1, 4)))
+        release = f'{rng.randint(1, 30)}.fc{rng.randint(28, 31)}'
+        nvrs.append(f'{name}-{version}-{release}')
+
+    return nvrs
+
+
+@click.command()
+@click.option('--count', default=20000, help='Number of NVRs to sort')
+@click.option('--repeat', default=5, help='Number of times to sort them')
+def main(count, repeat):
+    nvrs = make_nvrs(count, random.Random(42))
+
+    pairwise = timeit.timeit(lambda: sorted(nvrs, key=functools.cmp_to_key(compare_nvrs)),
+                             number=repeat)
+
+    set_sort_key_cache_size(count)
+    first = timeit.timeit(lambda: sorted(nvrs, key=nvr_sort_key), number=1)
+    memoized = timeit.timeit(lambda: sorted(nvrs, key=nvr_sort_key), number=repeat)
+
+    print(f"Sorting {count} NVRs, {repeat} times")
+    print(f"  pairwise comparison: {pairwise / repeat * 1000:.1f}ms per sort")
+    print(f"  sort key, first sort: {first * 1000:.1f}ms")
+    print(f"  sort key, memoized: {memoized / repeat * 1000:.1f}ms per sort")
+
+
+if __name__ == '__main__':
+    main()
@@ -34,8 +34,10 @@ pytest --cov=flatpak_status --cov-report=term-missing tests
 [ $? == 0 ] || failed="$failed pytest"
 flake8 flatpak_status tools tests
 [ $? == 0 ] || failed="$failed flake8"
-node_modules/.bin/eslint web/status.js
+node_modules/.bin/eslint web/status.js web/status-worker.js web/verdicts.js tests/test-verdicts.js
 [ $? == 0 ] || failed="$failed eslint"
+node tests/test-verdicts.js
+[ $? == 0 ] || failed="$failed node"
 
 set -e +x
 
@@ -0,0 +1,77 @@
+'use strict';
+
+/* global importScripts, isFlatpakBuildGood, hasFlatpakBuildSecurityUpdates,
+   flatpakBuildOutOfDatePackages, isFlatpakGood, hasFlatpakSecurityUpdates */
+
+// Fetches and parses status.json off the main thread, and sends the page
+// summaries of the Flatpaks and their builds, without the packages, which
+// are most of the data. The packages of a build are sent when asked for.
+
+importScripts('verdicts.js');
+
+// Flatpak name => Flatpak, as in status.json
+let flatpaks = new Map();
+// Each summary gets a new generation, so the page can tell when to rerender
+let generation = 0;
+
+function summarizeBuild(build) {
+    return {
+        build: build.build,
+        update: build.update,
+        good: isFlatpakBuildGood(build),
+        has_security_updates: hasFlatpakBuildSecurityUpdates(build),
+        out_of_date_packages: flatpakBuildOutOfDatePackages(build),
+    };
+}
+
+function summarizeFlatpak(flatpak) {
+    return {
+        name: flatpak.name,
+        builds: flatpak.builds.map(summarizeBuild),
+        good: isFlatpakGood(flatpak),
+        has_security_updates: hasFlatpakSecurityUpdates(flatpak),
+        stale: flatpak.stale,
+        generation: ++generation,
+    };
+}
+
+function load(url) {
+    fetch(url).then((res) => res.json()).then((data) => {
+        flatpaks = new Map(data.flatpaks.map((flatpak) => [flatpak.name, flatpak]));
+        self.postMessage({
+            type: 'summary',
+            date_updated: data.date_updated,
+            flatpaks: data.flatpaks.map(summarizeFlatpak),
+        });
+    }).catch((error) => {
+        self.postMessage({type: 'error', message: error.toString()});
+    });
+}
+
+function sendPackages(name, nvr) {
+    let packages = [];
+    const flatpak = flatpaks.get(name);
+    if (flatpak !== undefined) {
+        const build = flatpak.builds.find((build) => build.build.nvr == nvr);
+        if (build !== undefined) {
+            packages = build.packages;
+        }
+    }
+
+    self.postMessage({type: 'packages', name, nvr, packages});
+}
+
+self.onmessage = (event) => {
+    const message = event.data;
+    if (message.type == 'load') {
+        load(message.url);
+    } else if (message.type == 'packages') {
+        sendPackages(message.name, message.nvr);
+    } else if (message.type == 'flatpak') {
+        const flatpak = JSON.parse(message.data);
+        flatpaks.set(flatpak.name, flatpak);
+        self.postMessage({type: 'flatpak', flatpak: summarizeFlatpak(flatpak)});
+    } else if (message.type == 'removed') {
+        flatpaks.delete(message.name);
+    }
+};
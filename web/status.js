@@ -1,14 +1,5 @@
 'use strict';
 
-function nvrSplit(nvr) {
-    return /(.*)-([^-]*)-([^-]*)/.exec(nvr).slice(1);
-}
-
-function isRuntime(nvr) {
-    const name = nvrSplit(nvr)[0];
-    return name == 'flatpak-runtime' || name == 'flatpak-sdk';
-}
-
 function makeBuildUrl(build) {
     return `https://koji.fedoraproject.org/koji/buildinfo?buildID=${build.id}`;
 }
@@ -25,73 +16,6 @@ function makeUpdateLinkClass(update) {
     return result;
 }
 
-function isPackageGood(pkg) {
-    return (pkg.commit == pkg.history[0].commit ||
-            (pkg.history.length > 1 && (pkg.history[0].update.status == 'testing' &&
-                                        pkg.commit == pkg.history[1].commit)));
-}
-
-function isFlatpakBuildGood(flatpak) {
-    for (const pkg of flatpak.packages) {
-        if (!isPackageGood(pkg)) {
-            return false;
-        }
-    }
-
-    return true;
-}
-
-function hasFlatpakBuildSecurityUpdates(flatpak) {
-    for (const pkg of flatpak.packages) {
-        for (const item of pkg.history) {
-            if (item.commit == pkg.commit) {
-                break;
-            }
-
-            if (item.update.type == 'security' && item.update.status != 'testing') {
-                return true;
-            }
-        }
-    }
-
-    return false;
-}
-
-function flatpakBuildStatusString(flatpak) {
-    const badPackages = [];
-    for (const pkg of flatpak.packages) {
-        if (!isPackageGood(pkg)) {
-            badPackages.push(nvrSplit(pkg.build.nvr)[0]);
-        }
-    }
-
-    if (badPackages.length == 0) {
-        return 'All packages up to date';
-    } else {
-        return 'Out-of-date: ' + badPackages.join(', ');
-    }
-}
-
-function isFlatpakGood(flatpak) {
-    for (const build of flatpak.builds) {
-        if (!isFlatpakBuildGood(build)) {
-            return false;
-        }
-    }
-
-    return true;
-}
-
-function hasFlatpakSecurityUpdates(flatpak) {
-    for (const build of flatpak.builds) {
-        if (hasFlatpakBuildSecurityUpdates(build)) {
-            return true;
-        }
-    }
-
-    return false;
-}
-
 Vue.component('flatpak-item', {
     props: {
         'flatpak': Object,
@@ -105,30 +29,32 @@ Vue.component('flatpak-item', {
             return this.good || !hasFlatpakSecurityUpdates(this.flatpak);
         },
     },
+    methods: {
+        show() {
+            app.showFlatpak(this.flatpak.name);
+        },
+    },
     template: `
-        <a :class="{item: true, bad: !good, insecure: !secure}"
-           :href="'#' + flatpak.name" >{{ flatpak.name }}</a>
+        <a :class="{item: true, bad: !good, insecure: !secure, stale: flatpak.stale}"
+           :href="'#' + flatpak.name" @click.prevent="show">{{ flatpak.name }}</a>
     `,
 });
 
+// Flatpaks are rendered from summaries without the packages; the packages
+// of a build are only fetched from the worker when the build is expanded.
 Vue.component('flatpak-details', {
     props: {
         'flatpak': Object,
     },
-    methods: {
-        shouldExpand(build) {
-            return (!isRuntime(build.build.nvr) &&
-                    build.build.nvr == this.flatpak.builds[0].build.nvr &&
-                    !isFlatpakBuildGood(build));
-        },
-    },
     template: `
         <div class="flatpak">
-            <div class="header" :id="flatpak.name"> {{ flatpak.name }}</div>
+            <div class="header" :id="flatpak.name"> {{ flatpak.name }}
+                <span v-if="flatpak.stale" class="stale">(couldn't be checked, out of date)</span>
+            </div>
             <flatpak-build v-for="build in flatpak.builds"
+                           :flatpak-name="flatpak.name"
                            :build="build"
-                           :key="build.build.nvr"
-                           :initial-expand="shouldExpand(build)">
+                           :key="build.build.nvr">
             </flatpak-build>
        </div>
     `,
@@ -136,14 +62,20 @@ Vue.component('flatpak-details', {
 
 Vue.component('flatpak-build', {
     props: {
+        'flatpakName': String,
         'build': Object,
-        'initial-expand': Boolean,
     },
     data() {
+        // Rows are destroyed when scrolled out of view, so state is kept by the app
+        const key = buildKey(this.flatpakName, this.build.build.nvr);
         return {
-            expanded: this.initialExpand,
+            expanded: expandedBuilds.has(key),
+            packages: loadedPackages.has(key) ? loadedPackages.get(key).packages : null,
         };
     },
+    created() {
+        this.loadPackagesIfExpanded();
+    },
     computed: {
         buildUrl() {
             return makeBuildUrl(this.build.build);
@@ -166,7 +98,22 @@ Vue.component('flatpak-build', {
     },
     methods: {
         toggleExpanded() {
+            const key = buildKey(this.flatpakName, this.build.build.nvr);
             this.expanded = !this.expanded;
+            if (this.expanded) {
+                expandedBuilds.add(key);
+            } else {
+                expandedBuilds.delete(key);
+            }
+
+            this.loadPackagesIfExpanded();
+        },
+        loadPackagesIfExpanded() {
+            if (this.expanded && this.packages === null) {
+                loadPackages(this.flatpakName, this.build.build.nvr).then((packages) => {
+                    this.packages = packages;
+                });
+            }
         },
     },
     template: `
@@ -197,8 +144,9 @@ Vue.component('flatpak-build', {
                        </tr>
                   </table>
               </div>
-              <div class="packages">
-                  <flatpak-package v-for="pkg in build.packages"
+              <div v-if="packages === null" class="packages loading">Loading…</div>
+              <div v-else class="packages">
+                  <flatpak-package v-for="pkg in packages"
                                    :pkg="pkg"
                                    :key="pkg.build.nvr">
                   </flatpak-package>
@@ -352,15 +300,252 @@ Vue.filter('dateFormat', function(date) {
         `${pad(d.getHours())}:${pad(d.getMinutes())}`;
 });
 
+// Renders only the items that are scrolled into view (plus some margin).
+// Items that haven't been rendered yet are assumed to be estimatedHeight
+// high; rendered items are measured, and remeasured when they change size -
+// when something in them is expanded, for example.
+Vue.component('virtual-list', {
+    props: {
+        'items': Array,
+        'keyField': String,
+        'estimatedHeight': Number,
+    },
+    data() {
+        return {
+            scrollTop: 0,
+            viewportHeight: 0,
+            heights: {},
+        };
+    },
+    computed: {
+        offsets() {
+            const offsets = [0];
+            let offset = 0;
+            for (const item of this.items) {
+                const height = this.heights[item[this.keyField]];
+                offset += height !== undefined ? height : this.estimatedHeight;
+                offsets.push(offset);
+            }
+
+            return offsets;
+        },
+        visible() {
+            const margin = this.viewportHeight;
+            const top = this.scrollTop - margin;
+            const bottom = this.scrollTop + this.viewportHeight + margin;
+
+            const result = [];
+            for (let i = this.firstIndexBelow(top); i < this.items.length; i++) {
+                if (this.offsets[i] > bottom) {
+                    break;
+                }
+                result.push({item: this.items[i], index: i});
+            }
+
+            return result;
+        },
+    },
+    mounted() {
+        this.onResize = () => {
+            this.viewportHeight = this.$el.clientHeight;
+        };
+        window.addEventListener('resize', this.onResize);
+        this.onResize();
+
+        this.resizeObserver = new ResizeObserver((entries) => {
+            for (const entry of entries) {
+                const key = entry.target.dataset.key;
+                const height = entry.target.offsetHeight;
+                if (this.heights[key] !== height) {
+                    this.$set(this.heights, key, height);
+                }
+            }
+        });
+    },
+    beforeDestroy() {
+        window.removeEventListener('resize', this.onResize);
+        this.resizeObserver.disconnect();
+    },
+    updated() {
+        // Observing an element reports its initial size
+        this.resizeObserver.disconnect();
+        for (const row of this.$refs.content.children) {
+            this.resizeObserver.observe(row);
+        }
+    },
+    methods: {
+        // Binary search for the first item whose bottom is below y
+        firstIndexBelow(y) {
+            let low = 0;
+            let high = this.items.length;
+            while (low < high) {
+                const mid = (low + high) >> 1;
+                if (this.offsets[mid + 1] <= y) {
+                    low = mid + 1;
+                } else {
+                    high = mid;
+                }
+            }
+
+            return low;
+        },
+        onScroll() {
+            this.scrollTop = this.$el.scrollTop;
+        },
+        scrollToKey(key) {
+            const index = this.items.findIndex((item) => item[this.keyField] == key);
+            if (index >= 0) {
+                this.$el.scrollTop = this.offsets[index];
+            }
+        },
+    },
+    template: `
+        <div class="virtual-list" @scroll="onScroll">
+            <div ref="content" class="virtual-list-content"
+                 :style="{height: offsets[items.length] + 'px'}">
+                <div v-for="entry in visible"
+                     class="virtual-list-row"
+                     :key="entry.item[keyField]"
+                     :data-key="entry.item[keyField]"
+                     :style="{top: offsets[entry.index] + 'px'}">
+                    <slot :item="entry.item"></slot>
+                </div>
+            </div>
+        </div>
+    `,
+});
+
+// status.json is fetched and parsed by a worker, which sends back summaries
+// of the Flatpaks, without the package histories. Those are requested
+// from the worker when a build is expanded.
+const worker = new Worker('status-worker.js');
+
+function buildKey(flatpakName, nvr) {
+    return flatpakName + '/' + nvr;
+}
+
+const expandedBuilds = new Set();
+// build key => {promise, resolve, packages}
+const loadedPackages = new Map();
+
+function forgetPackages(flatpakName) {
+    for (const key of [...loadedPackages.keys()]) {
+        if (key.startsWith(flatpakName + '/')) {
+            loadedPackages.delete(key);
+        }
+    }
+}
+
+function loadPackages(flatpakName, nvr) {
+    const key = buildKey(flatpakName, nvr);
+    let loaded = loadedPackages.get(key);
+    if (loaded === undefined) {
+        loaded = {packages: null};
+        loaded.promise = new Promise((resolve) => {
+            loaded.resolve = resolve;
+        });
+        loadedPackages.set(key, loaded);
+        worker.postMessage({type: 'packages', name: flatpakName, nvr});
+    }
+
+    return loaded.promise;
+}
+
 const app = new Vue({
     el: '#app',
     data: {
         'date_updated': null,
         'flatpaks': [],
     },
+    methods: {
+        showFlatpak(name) {
+            history.replaceState(null, '', '#' + name);
+            this.$refs.list.scrollToKey(name);
+        },
+    },
 });
 
-fetch('status.json').then((res) => res.json()).then((res) => {
-    app.date_updated = res['date_updated'];
-    app.flatpaks = res['flatpaks'];
-});
+worker.onmessage = (event) => {
+    const message = event.data;
+    if (message.type == 'summary') {
+        app.date_updated = message.date_updated;
+        app.flatpaks = message.flatpaks;
+
+        if (location.hash) {
+            app.$nextTick(() => app.showFlatpak(decodeURIComponent(location.hash.substring(1))));
+        }
+    } else if (message.type == 'flatpak') {
+        updateFlatpak(message.flatpak);
+    } else if (message.type == 'packages') {
+        const loaded = loadedPackages.get(buildKey(message.name, message.nvr));
+        if (loaded !== undefined) {
+            loaded.packages = message.packages;
+            loaded.resolve(message.packages);
+        }
+    } else if (message.type == 'error') {
+        console.error(`Failed to load status.json: ${message.message}`);
+    }
+};
+
+function load() {
+    loadedPackages.clear();
+    worker.postMessage({type: 'load', url: new URL('status.json', location.href).href});
+}
+
+// Replaces or adds the summary of a Flatpak that changed. Its components
+// are recreated, since the summary has a new generation, and refetch the
+// packages of expanded builds.
+function updateFlatpak(flatpak) {
+    forgetPackages(flatpak.name);
+
+    const flatpaks = app.flatpaks;
+    const index = flatpaks.findIndex((f) => f.name >= flatpak.name);
+    if (index < 0) {
+        flatpaks.push(flatpak);
+    } else if (flatpaks[index].name == flatpak.name) {
+        flatpaks.splice(index, 1, flatpak);
+    } else {
+        flatpaks.splice(index, 0, flatpak);
+    }
+}
+
+function removeFlatpak(name) {
+    forgetPackages(name);
+    app.flatpaks = app.flatpaks.filter((f) => f.name != name);
+}
+
+// When the daemon's event stream is served as 'events' (see README.md),
+// Flatpaks that change are patched in as they are published.
+function subscribe() {
+    const source = new EventSource('events');
+    let connected = false;
+
+    source.onopen = () => {
+        if (connected) {
+            // Reconnected, so changes might have been missed
+            load();
+        }
+        connected = true;
+    };
+    source.onerror = () => {
+        if (!connected) {
+            // Not available - don't keep retrying
+            source.close();
+        }
+    };
+    source.addEventListener('flatpak', (event) => {
+        // Parsed by the worker, which keeps the full data
+        worker.postMessage({type: 'flatpak', data: event.data});
+    });
+    source.addEventListener('removed', (event) => {
+        const name = JSON.parse(event.data).name;
+        worker.postMessage({type: 'removed', name});
+        removeFlatpak(name);
+    });
+    source.addEventListener('updated', (event) => {
+        app.date_updated = JSON.parse(event.data).date_updated;
+    });
+}
+
+load();
+subscribe();
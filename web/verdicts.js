@@ -0,0 +1,111 @@
+'use strict';
+
+/* global module */
+
+// Whether Flatpak builds and the packages in them are up-to-date. These are
+// computed by flatpak-status and included in status.json; the computations
+// here are only a fallback for output from older versions. They are checked
+// against the same cases as the Python code (tests/verdicts.json) by
+// tests/test-verdicts.js.
+
+function nvrSplit(nvr) {
+    return /(.*)-([^-]*)-([^-]*)/.exec(nvr).slice(1);
+}
+
+function isPackageGood(pkg) {
+    if (pkg.good !== undefined) {
+        return pkg.good;
+    }
+
+    // Up-to-date, or only missing an update that's still in testing
+    const newest = pkg.history[0];
+    return (pkg.commit == newest.commit ||
+            (pkg.history.length > 1 && newest.update !== undefined &&
+             newest.update.status == 'testing' && pkg.commit == pkg.history[1].commit));
+}
+
+function hasPackageSecurityUpdates(pkg) {
+    for (const item of pkg.history) {
+        if (item.commit == pkg.commit) {
+            break;
+        }
+
+        if (item.update !== undefined &&
+            item.update.type == 'security' && item.update.status != 'testing') {
+            return true;
+        }
+    }
+
+    return false;
+}
+
+function flatpakBuildOutOfDatePackages(flatpak) {
+    if (flatpak.out_of_date_packages !== undefined) {
+        return flatpak.out_of_date_packages;
+    }
+
+    return flatpak.packages
+        .filter((pkg) => !isPackageGood(pkg))
+        .map((pkg) => nvrSplit(pkg.build.nvr)[0]);
+}
+
+function isFlatpakBuildGood(flatpak) {
+    if (flatpak.good !== undefined) {
+        return flatpak.good;
+    }
+
+    return flatpak.packages.every(isPackageGood);
+}
+
+function hasFlatpakBuildSecurityUpdates(flatpak) {
+    if (flatpak.has_security_updates !== undefined) {
+        return flatpak.has_security_updates;
+    }
+
+    return flatpak.packages.some(hasPackageSecurityUpdates);
+}
+
+function flatpakBuildStatusString(flatpak) {
+    const badPackages = flatpakBuildOutOfDatePackages(flatpak);
+
+    if (badPackages.length == 0) {
+        return 'All packages up to date';
+    } else {
+        return 'Out-of-date: ' + badPackages.join(', ');
+    }
+}
+
+function isFlatpakGood(flatpak) {
+    if (flatpak.good !== undefined) {
+        return flatpak.good;
+    }
+
+    // Not checked at all - neither good nor bad
+    if (flatpak.stale && flatpak.builds.length == 0) {
+        return null;
+    }
+
+    return flatpak.builds.every(isFlatpakBuildGood);
+}
+
+function hasFlatpakSecurityUpdates(flatpak) {
+    if (flatpak.has_security_updates !== undefined) {
+        return flatpak.has_security_updates;
+    }
+
+    return flatpak.builds.some(hasFlatpakBuildSecurityUpdates);
+}
+
+if (typeof module !== 'undefined') {
+    module.exports = {
+        nvrSplit,
+        isPackageGood,
+        hasPackageSecurityUpdates,
+        flatpakBuildOutOfDatePackages,
+        isFlatpakBuildGood,
+        hasFlatpakBuildSecurityUpdates,
+        flatpakBuildStatusString,
+        isFlatpakGood,
+        hasFlatpakSecurityUpdates,
+    };
+}